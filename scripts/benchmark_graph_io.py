@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the loading time of a graph saved as GraphML and as Parquet tables.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from superblockify.utils import load_graphml_dtypes
+from graph_io import save_graph_parquet, load_graph_parquet
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "filepath",
+        nargs="?",
+        default="./data/processed/city_partners_public/graphs_SB/Milan_Metropolitan/Milan_Metropolitan.graphml",
+        help="Path of the GraphML file to benchmark.",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    G = load_graphml_dtypes(args.filepath)
+    with tempfile.TemporaryDirectory() as folder:
+        filepath = os.path.join(folder, "graph")
+        save_graph_parquet(G, filepath)
+        for name, func, path in [
+            ["GraphML", load_graphml_dtypes, args.filepath],
+            ["Parquet", load_graph_parquet, filepath],
+        ]:
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                func(path)
+                times.append(time.perf_counter() - start)
+            print(f"{name}: best of {args.repeat} in {min(times):.2f}s")
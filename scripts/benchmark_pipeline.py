@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the hot steps of the pipelines offline, on synthetic street grids.
+Results are saved as JSON per commit, to be compared with --compare.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import shapely
+from city_partners_04_process import city_row
+from distances import (
+    avoid_zerodiv_matrix,
+    path_distance_matrix,
+    relative_travel_stats,
+    restricted_distance_matrix,
+    restricted_partitions,
+    sampled_relative_travel,
+)
+from graph_io import load_edge_columns, save_graph_parquet
+from utils import (
+    add_edge_distances,
+    ltn_labels,
+    ltn_overlay,
+    remove_dead_ends,
+    set_ltn_labels,
+    tag_edges_in_buffer,
+    tag_edges_within,
+)
+
+
+# Streets every ARTERIAL_EVERY lines are arterials, the blocks between them are the LTNs
+SPACING = 100
+ARTERIAL_EVERY = 5
+
+
+class SyntheticPartitioner:
+    "Minimal stand-in for a superblockify partitioner, with the attributes used by the scripts."
+
+    def __init__(self, graph, partitions, sparsified):
+        self.graph = graph
+        self.partitions = partitions
+        self.sparsified = sparsified
+
+    def get_partition_nodes(self):
+        "Get the partitions with their nodes that are not in the sparsified graph, as superblockify does."
+        return [
+            {
+                "name": p["name"],
+                "subgraph": p["subgraph"],
+                "nodes": {n for n in p["subgraph"] if n not in self.sparsified},
+            }
+            for p in self.partitions
+        ]
+
+
+def synthetic_grid(n_nodes, seed=0):
+    "Get a projected street grid of about n_nodes nodes, and a partitioner of its blocks."
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_nodes)))
+    G = nx.MultiDiGraph(crs="EPSG:32629")
+    coords = {}
+    for i in range(side):
+        for j in range(side):
+            coords[i * side + j] = (
+                i * SPACING + rng.uniform(-10, 10),
+                j * SPACING + rng.uniform(-10, 10),
+            )
+    pairs = [
+        (i * side + j, i * side + j + 1, "primary" if i % ARTERIAL_EVERY == 0 else None)
+        for i in range(side)
+        for j in range(side - 1)
+    ] + [
+        (
+            i * side + j,
+            (i + 1) * side + j,
+            "primary" if j % ARTERIAL_EVERY == 0 else None,
+        )
+        for i in range(side - 1)
+        for j in range(side)
+    ]
+    # Dead-ends of two nodes, to be pruned
+    n = side * side
+    for u in rng.choice(side * side, size=max(1, n_nodes // 50), replace=False):
+        x, y = coords[u]
+        coords[n] = (x + SPACING / 3, y + SPACING / 3)
+        coords[n + 1] = (x + SPACING / 2, y + SPACING / 3)
+        pairs += [(u, n, None), (n, n + 1, None)]
+        n += 2
+    for node, (x, y) in coords.items():
+        G.add_node(node, x=x, y=y, lon=x / 1e5, lat=y / 1e5, osmid=node)
+    osmid = 0
+    for u, v, highway in pairs:
+        highway = highway or "residential"
+        speed = 50.0 if highway == "primary" else 30.0
+        for a, b in [(u, v), (v, u)]:
+            geometry = shapely.LineString([coords[a], coords[b]])
+            dx, dy = coords[b][0] - coords[a][0], coords[b][1] - coords[a][1]
+            cell = shapely.box(
+                min(coords[a][0], coords[b][0]) - SPACING / 4,
+                min(coords[a][1], coords[b][1]) - SPACING / 4,
+                max(coords[a][0], coords[b][0]) + SPACING / 4,
+                max(coords[a][1], coords[b][1]) + SPACING / 4,
+            )
+            G.add_edge(
+                a,
+                b,
+                geometry=geometry,
+                osmid=osmid,
+                length=geometry.length,
+                highway=highway,
+                speed_kph=speed,
+                travel_time=geometry.length / (speed / 3.6),
+                bearing=float(np.degrees(np.arctan2(dx, dy)) % 360),
+                cell=cell,
+                cell_area=cell.area,
+                population=float(rng.uniform(0, 20)),
+            )
+        osmid += 1
+    nx.set_node_attributes(G, dict(G.degree()), "street_count")
+    G.graph["boundary"] = shapely.box(
+        *shapely.total_bounds(shapely.points(list(coords.values())))
+    )
+    G.graph["area"] = G.graph["boundary"].area
+    G.graph["avg_rel_travel"] = 1.0
+    G.graph["max_detour"] = 0.0
+    # Blocks between arterials, without the dead-ends, are the partitions
+    block_edges = {}
+    sparsified_edges = []
+    for u, v, k in G.edges(keys=True):
+        blocks = {
+            (node // side // ARTERIAL_EVERY, node % side // ARTERIAL_EVERY)
+            for node in (u, v)
+            if node < side * side
+        }
+        if len(blocks) == 1 and G.edges[u, v, k]["highway"] == "residential":
+            block_edges.setdefault(blocks.pop(), []).append((u, v, k))
+        else:
+            sparsified_edges.append((u, v, k))
+    partitions = []
+    for block, edges in block_edges.items():
+        subgraph = G.edge_subgraph(edges)
+        area = len(edges) * SPACING**2 / 4
+        partitions.append(
+            {
+                "name": f"{block[0]}_{block[1]}",
+                "subgraph": subgraph,
+                "area": area,
+                "n": subgraph.number_of_nodes(),
+            }
+        )
+    part = SyntheticPartitioner(G, partitions, G.edge_subgraph(sparsified_edges))
+    return G, part
+
+
+def measure(setup, func, repeat=1):
+    "Get the best time in seconds of func(*setup()) over repeat runs and its peak memory in MB."
+    seconds = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        seconds.append(time.perf_counter() - start)
+    args = setup()
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(seconds), peak / 1e6
+
+
+def get_steps(G, part, folder_tmp, dense=True):
+    "Get the steps to benchmark on G and part, as name, setup and function."
+    rng = np.random.default_rng(0)
+    bounds = G.graph["boundary"].bounds
+    schools = gpd.GeoSeries(
+        shapely.points(
+            rng.uniform(bounds[0], bounds[2], size=max(1, len(G) // 500)),
+            rng.uniform(bounds[1], bounds[3], size=max(1, len(G) // 500)),
+        )
+    )
+    add_edge_distances(G, schools, "school_distance")
+    overlay = ltn_overlay(part)
+    names = [p["name"] for p in part.partitions if p["n"] > 5]
+    partitions = restricted_partitions(
+        G, part.get_partition_nodes(), ltn_labels(overlay, names), names
+    )
+    set_ltn_labels(G, ltn_labels(overlay, names))
+    save_graph_parquet(G, os.path.join(folder_tmp, "graph"))
+    edges = load_edge_columns(
+        os.path.join(folder_tmp, "graph"),
+        ["length", "population", "cell_area", "highway", "in_ltn"],
+    )
+    steps = [
+        ["remove_dead_ends", lambda: [G.copy()], remove_dead_ends],
+        [
+            "tag_edges_in_buffer",
+            lambda: [G.copy(), schools.buffer(100)],
+            tag_edges_in_buffer,
+        ],
+        [
+            "add_edge_distances",
+            lambda: [G.copy(), schools, "school_distance"],
+            add_edge_distances,
+        ],
+        [
+            "tag_edges_within",
+            lambda: [G.copy(), "school_distance", 100],
+            tag_edges_within,
+        ],
+        [
+            "ltn_labels",
+            lambda: [G.copy()],
+            lambda H: [
+                set_ltn_labels(H, ltn_labels(ltn_overlay(part), selection))
+                for selection in [None, names]
+            ],
+        ],
+        [
+            "sampled_relative_travel",
+            lambda: [G, partitions, "length", 100],
+            sampled_relative_travel,
+        ],
+        [
+            "city_row",
+            lambda: [edges, G.graph, "Synthetic", len(names), "betweenness"],
+            city_row,
+        ],
+    ]
+    if not dense:
+        return steps
+    dg = path_distance_matrix(G, "length", folder_tmp)
+    dgr = restricted_distance_matrix(
+        G, partitions, "length", list(G.nodes), dtype=np.float64
+    )
+    steps += [
+        [
+            "path_distance_matrix",
+            lambda: [G, "length", tempfile.mkdtemp(dir=folder_tmp)],
+            path_distance_matrix,
+        ],
+        [
+            "restricted_distance_matrix",
+            lambda: [G, partitions, "length", list(G.nodes), np.float64],
+            restricted_distance_matrix,
+        ],
+        [
+            "restricted_distance_matrix_float32",
+            lambda: [G, partitions, "length", list(G.nodes), np.float32],
+            restricted_distance_matrix,
+        ],
+        [
+            "avoid_zerodiv_matrix",
+            lambda: [dgr, np.asarray(dg, dtype=np.float64)],
+            avoid_zerodiv_matrix,
+        ],
+        ["relative_travel_stats", lambda: [dgr, dg], relative_travel_stats],
+    ]
+    return steps
+
+
+def current_commit():
+    "Get the short hash of the current git commit, or None outside of a git repository."
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(path_old, path_new):
+    "Print the ratios of time and peak memory between the results of two benchmark files."
+    results = []
+    for path in [path_old, path_new]:
+        with open(path) as f:
+            results.append(
+                {(r["step"], r["n_nodes"]): r for r in json.load(f)["results"]}
+            )
+    print(f"{'step':<36}{'nodes':>8}{'time':>10}{'memory':>10}")
+    for key, new in results[1].items():
+        old = results[0].get(key)
+        if old is None:
+            continue
+        print(
+            f"{key[0]:<36}{key[1]:>8}"
+            f"{new['seconds'] / old['seconds']:>9.2f}x"
+            f"{new['peak_mb'] / max(old['peak_mb'], 1e-6):>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 50000],
+        help="Approximate numbers of nodes of the synthetic grids.",
+    )
+    parser.add_argument(
+        "--max-dense",
+        type=int,
+        default=10000,
+        help="Maximal size for the steps with node-to-node matrices, that need O(n²) memory.",
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Path of the JSON results, default to ./data/processed/benchmarks/{commit}.json.",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="Compare two JSON results instead of running the benchmarks.",
+    )
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        raise SystemExit
+    commit = current_commit()
+    output = args.output or f"./data/processed/benchmarks/{commit}.json"
+    results = []
+    with tempfile.TemporaryDirectory() as folder_tmp:
+        for size in args.sizes:
+            G, part = synthetic_grid(size)
+            for name, setup, func in get_steps(
+                G, part, folder_tmp, dense=size <= args.max_dense
+            ):
+                seconds, peak_mb = measure(setup, func, repeat=args.repeat)
+                print(f"{name:<36}{len(G):>8} nodes {seconds:>9.3f}s {peak_mb:>9.1f}MB")
+                results.append(
+                    {
+                        "step": name,
+                        "n_nodes": len(G),
+                        "n_edges": G.number_of_edges(),
+                        "seconds": seconds,
+                        "peak_mb": peak_mb,
+                    }
+                )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "max_dense": args.max_dense,
+                "results": results,
+            },
+            f,
+            indent=1,
+        )
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the stages of the pipelines, keyed by a hash of their inputs and parameters.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+
+
+def file_hash(path):
+    "Get the SHA-256 hash of the content of the file at path."
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stage_key(stage, files=(), params=None):
+    "Get the hash of the stage, the content of the files and the JSON serializable params."
+    h = hashlib.sha256(stage.encode())
+    for path in files:
+        h.update(file_hash(path).encode())
+    h.update(json.dumps(params, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def graph_hash(G, weight=None):
+    "Get the SHA-256 hash of the nodes of G in order and of its edges with their weight attribute."
+    h = hashlib.sha256()
+    h.update(repr(list(G.nodes)).encode())
+    h.update(
+        repr(
+            [(u, v, k, d.get(weight)) for u, v, k, d in G.edges(keys=True, data=True)]
+        ).encode()
+    )
+    return h.hexdigest()
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """
+    Get a temporary path to write instead of path, renamed to path once written.
+    Concurrent or interrupted runs then never leave or read a partial file.
+    """
+    path_tmp = f"{path}.{os.getpid()}.tmp"
+    yield path_tmp
+    os.replace(path_tmp, path)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    "Hold an exclusive lock on path + '.lock', shared by all processes on the same machine."
+    with open(path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_cached(folder_cache, name, key):
+    "Get the record of name in folder_cache if its key matches and its outputs exist."
+    path = os.path.join(folder_cache, name + ".json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        record = json.load(f)
+    if record["key"] != key or not all(os.path.exists(p) for p in record["outputs"]):
+        return None
+    return record
+
+
+def save_cached(folder_cache, name, key, outputs=(), data=None):
+    "Save in folder_cache the record of name with its key, outputs and data."
+    os.makedirs(folder_cache, exist_ok=True)
+    path = os.path.join(folder_cache, name + ".json")
+    with atomic_write(path) as path_tmp, open(path_tmp, "w") as f:
+        json.dump({"key": key, "outputs": list(outputs), "data": data}, f)
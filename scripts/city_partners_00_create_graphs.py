@@ -1,65 +1,204 @@
 # -*- coding: utf-8 -*-
 """
 Create graph for all cities from gpkg file with a polygon in each, see "./data/raw/city_partners_public/00_source.txt" for more information. 
+Graphs are queried from Overpass, or clipped from a local OSM extract with --extract.
 """
 
 
+import argparse
+import concurrent.futures
 import os
-import pandas as pd
-import geopandas as gpd
+import traceback
 import osmnx as ox
 import tqdm
 import networkx as nx
+from cache import file_hash, stage_key, load_cached, save_cached
+from graph_io import save_graph_parquet, graph_parquet_paths
+from gpkg_io import read_gpkg, save_graph_gpkg
+from osm_extract import graphs_from_extract
+from parallel import print_failed_jobs
+from profiling import StepManifest
+from rendering import plot_graph_file
+from utils import FOLDER_CITY_PARTNERS
 
 
-if __name__ == "__main__":
-    folder_poly = "./data/raw/city_partners_public/"
-    folder_graph = "./data/processed/city_partners_public/graphs_OSM/"
-    folder_geom = "./data/processed/city_partners_public/geoms/"
-    folder_plot = "./plots/city_partners_public/graphs/"
-    # Get all polygon files
-    for file_poly in tqdm.tqdm(
-        sorted(
-            [
-                filename
-                for filename in os.listdir(folder_poly)
-                if filename.endswith(".gpkg")
-            ]
+def create_graphs(
+    file_polys,
+    extract=None,
+    force=False,
+    profile_step=None,
+    on_saved=None,
+    folder=FOLDER_CITY_PARTNERS,
+):
+    """
+    Create and save in folder the graphs of the cities of file_polys, unless they are cached.
+    Call on_saved with each saved city and return the cities whose graph was created.
+    """
+    folder_graph = folder + "graphs_OSM/"
+    folder_geom = folder + "geoms/"
+    folder_cache = folder + "cache/00_create_graphs/"
+    os.makedirs(folder_geom, exist_ok=True)
+    params = {"network_type": "drive"}
+    if extract is not None:
+        params["extract"] = file_hash(extract)
+    # Get the polygons of cities without up-to-date outputs
+    todo = {}
+    for city_name, file_poly in file_polys.items():
+        key = stage_key("create_graphs", [file_poly], params)
+        if force or load_cached(folder_cache, city_name, key) is None:
+            todo[city_name] = (read_gpkg(file_poly).geometry[0], key)
+    graphs = {}
+    if extract is not None and todo:
+        manifest = StepManifest(
+            folder + "manifest.jsonl",
+            "00_create_graphs",
+            "all",
+            profile_step,
+        )
+        # Clip the graphs of all cities in a single read of the extract
+        with manifest.step("graphs_from_extract"):
+            graphs = graphs_from_extract(
+                extract, {city_name: poly for city_name, (poly, _) in todo.items()}
+            )
+    for city_name, (poly, key) in tqdm.tqdm(todo.items()):
+        outputs = [
+            folder_graph + city_name + ".graphml",
+            *graph_parquet_paths(folder_graph + city_name),
+            folder_geom + city_name + ".gpkg",
+        ]
+        manifest = StepManifest(
+            folder + "manifest.jsonl",
+            "00_create_graphs",
+            city_name,
+            profile_step,
         )
+        with manifest.step("graph_from_polygon") as step:
+            if city_name in graphs:
+                G = graphs.pop(city_name)
+            else:
+                # Extract graph from OSM using OSMnx.
+                G = ox.graph_from_polygon(poly, network_type="drive", simplify=False)
+            step["graph"] = G
+        with manifest.step("clean_graph") as step:
+            toremove = []
+            # Remove forbidden places to drive
+            for e in G.edges:
+                if "access" in G.edges[e]:
+                    if G.edges[e]["access"] == "no":
+                        toremove.append(e)
+                if "area" in G.edges[e]:
+                    G.edges[e].pop("area")
+            G.remove_edges_from(toremove)
+            # Keep only the LCC and simplify
+            G = G.subgraph(max(nx.weakly_connected_components(G), key=len))
+            G = ox.simplify_graph(G)
+            step["graph"] = G
+        with manifest.step("save_graph", G):
+            ox.save_graphml(G, folder_graph + city_name + ".graphml")
+            save_graph_parquet(G, folder_graph + city_name)
+        if on_saved is not None:
+            on_saved(city_name)
+        # Save geometry of edges and nodes as layers of a gpkg to use GIS software for dynamic visualization and analysis
+        with manifest.step("save_gpkg", G):
+            save_graph_gpkg(G, folder_geom + city_name + ".gpkg")
+        save_cached(folder_cache, city_name, key, outputs)
+    return list(todo)
+
+
+def plot_city(city_name, folder_plot, folder=FOLDER_CITY_PARTNERS):
+    "Render in folder_plot the plot of the graph of city_name, unless it is up to date."
+    file_graph = folder + "graphs_OSM/" + city_name
+    file_plot = folder_plot + city_name + ".png"
+    if os.path.exists(file_plot) and os.path.getmtime(file_plot) >= max(
+        os.path.getmtime(path) for path in graph_parquet_paths(file_graph)
     ):
-        city_name = file_poly.split(".")[0]
-        poly = gpd.read_file(folder_poly + file_poly).geometry[0]
-        # Extract graph from OSM using OSMnx.
-        G = ox.graph_from_polygon(poly, network_type="drive", simplify=False)
-        toremove = []
-        # Remove forbidden places to drive
-        for e in G.edges:
-            if "access" in G.edges[e]:
-                if G.edges[e]["access"] == "no":
-                    toremove.append(e)
-            if "area" in G.edges[e]:
-                G.edges[e].pop("area")
-        G.remove_edges_from(toremove)
-        # Keep only the LCC and simplify
-        G = G.subgraph(max(nx.weakly_connected_components(G), key=len))
-        G = ox.simplify_graph(G)
-        ox.save_graphml(G, folder_graph + city_name + ".graphml")
-        # Save static figure
-        ox.plot_graph(
-            G,
-            figsize=(32, 32),
-            bgcolor="white",
-            node_color="black",
-            edge_color="#285c52",
-            node_size=7.5,
-            edge_linewidth=1,
-            save=True,
-            filepath=folder_plot + city_name + ".png",
-            dpi=300,
-            close=True,
-            show=False,
+        return
+    os.makedirs(folder_plot, exist_ok=True)
+    plot_graph_file(file_graph, file_plot)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--force", action="store_true", help="Ignore the cache and run all cities."
+    )
+    parser.add_argument(
+        "--profile-step",
+        default=None,
+        help="Name of a step to profile with cProfile for every city, see profiling.py.",
+    )
+    parser.add_argument(
+        "--extract",
+        default=None,
+        help="Path of a local OSM extract (.osm, .osm.bz2 or .osm.pbf) covering all polygons, read once instead of querying Overpass for each city.",
+    )
+    parser.add_argument(
+        "--polygons",
+        default="./data/raw/city_partners_public/",
+        help="Folder of the polygons of the cities, one gpkg file per city.",
+    )
+    parser.add_argument(
+        "--plots",
+        choices=["parallel", "defer", "skip"],
+        default="parallel",
+        help="Render the plots of the graphs in other processes while the next graphs are built, after all graphs are built, or not at all. Missing plots of cached cities are rendered unless skipped.",
+    )
+    parser.add_argument(
+        "--plot-workers",
+        type=int,
+        default=2,
+        help="Number of processes rendering plots, each taking about 1 GB of memory.",
+    )
+    args = parser.parse_args()
+    folder_poly = os.path.join(args.polygons, "")
+    folder_graph = FOLDER_CITY_PARTNERS + "graphs_OSM/"
+    folder_plot = "./plots/city_partners_public/graphs/"
+    os.makedirs(folder_plot, exist_ok=True)
+    file_polys = {
+        filename.split(".")[0]: folder_poly + filename
+        for filename in sorted(os.listdir(folder_poly))
+        if filename.endswith(".gpkg")
+    }
+    # Plots are rendered from the saved graphs by other processes, off the critical path
+    pool = None
+    if args.plots != "skip":
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=args.plot_workers)
+    plots = {}
+
+    def submit_plot(city_name):
+        "Render the plot of the saved graph of city_name in the pool."
+        plots[city_name] = pool.submit(
+            plot_graph_file,
+            folder_graph + city_name,
+            folder_plot + city_name + ".png",
         )
-        # Save geometry of edges and nodes as single gpkg to use GIS software for dynamic visualization and analysis
-        gdfs = ox.graph_to_gdfs(G)
-        geom = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True))
-        geom.to_file(folder_geom + city_name + ".gpkg")
+
+    todo = create_graphs(
+        file_polys,
+        extract=args.extract,
+        force=args.force,
+        profile_step=args.profile_step,
+        on_saved=submit_plot if args.plots == "parallel" else None,
+    )
+    if pool is not None:
+        for city_name in file_polys:
+            file_plot = folder_plot + city_name + ".png"
+            if city_name in plots or (
+                city_name not in todo and os.path.exists(file_plot)
+            ):
+                continue
+            if all(
+                os.path.exists(path)
+                for path in graph_parquet_paths(folder_graph + city_name)
+            ):
+                plots[city_name] = pool.submit(
+                    plot_graph_file, folder_graph + city_name, file_plot
+                )
+        failed = {}
+        for city_name, future in tqdm.tqdm(plots.items()):
+            try:
+                future.result()
+            except Exception:
+                failed[(city_name,)] = traceback.format_exc()
+        pool.shutdown()
+        print_failed_jobs(failed, len(plots))
@@ -4,64 +4,74 @@ Create a graph ready for superblockify partitioner algorithm from graph obtained
 """
 
 
+import argparse
 import os
-import shapely
-import networkx as nx
-import geopandas as gpd
 import osmnx as ox
 import superblockify as sb
-from superblockify.utils import load_graphml_dtypes, extract_attributes
-from superblockify.graph_stats import basic_graph_stats
-from superblockify.population import add_edge_cells
 import tqdm
+from cache import stage_key, load_cached, save_cached
+from graph_io import save_graph_parquet, load_graph_parquet, graph_parquet_paths
+from gpkg_io import read_gpkg
+from prepared_graphs import make_graph_compatible
+from profiling import StepManifest
+from utils import FOLDER_CITY_PARTNERS, GHSL_DIR
 
 
-def make_graph_compatible(G, poly=None, proj_crs=None):
-    "Get a graph extracted via OSMnx compatible with Superblockify BasePartitioner."
-    G = G.copy()
-    ox.add_edge_bearings(G)
-    G = ox.project_graph(G, to_crs=proj_crs)
-    G = ox.add_edge_speeds(G)
-    G = ox.add_edge_travel_times(G)
-    street_count = ox.stats.count_streets_per_node(G)
-    nx.set_node_attributes(G, values=street_count, name="street_count")
-    G = extract_attributes(
-        G,
-        edge_attributes={
-            "geometry",
-            "osmid",
-            "length",
-            "highway",
-            "speed_kph",
-            "travel_time",
-            "bearing",
-        },
-        node_attributes={"y", "x", "lat", "lon", "osmid", "street_count"},
+def prepare_graph(
+    city_name,
+    file_poly,
+    force=False,
+    profile_step=None,
+    folder=FOLDER_CITY_PARTNERS,
+    ghsl_dir=GHSL_DIR,
+):
+    "Make the graph of city_name compatible with Superblockify and save it, unless it is cached."
+    folder_graph_OSM = folder + "graphs_OSM/"
+    folder_graph = folder + "graphs_SB/"
+    folder_cache = folder + "cache/01_prepare_graphs/"
+    sb.config.Config.GHSL_DIR = ghsl_dir
+    folder_sb = folder_graph + city_name
+    os.makedirs(folder_sb, exist_ok=True)
+    outputs = [
+        folder_sb + "/" + city_name + ".graphml",
+        *graph_parquet_paths(folder_sb + "/" + city_name),
+    ]
+    key = stage_key(
+        "prepare_graphs",
+        [*graph_parquet_paths(folder_graph_OSM + city_name), file_poly],
+        {"ghsl_dir": sb.config.Config.GHSL_DIR},
     )
-    add_edge_cells(G)
-    sb.add_edge_population(G)
-    if poly is None:
-        gdf_edges = ox.graph_to_gdfs(G, nodes=False, edges=True)
-        streetgeom = gdf_edges.geometry.unary_union
-        bb = streetgeom.bounds
-        poly = gpd.GeoDataFrame(
-            shapely.Polygon(
-                [[bb[2], bb[1]], [bb[2], bb[3]], [bb[0], bb[3]], [bb[0], bb[1]]]
-            ),
-            crs=proj_crs,
-        )
-    G.graph["boundary_crs"] = poly.crs
-    G.graph["boundary"] = poly.geometry[0]
-    G.graph["area"] = G.graph["boundary"].area
-    G.graph.update(basic_graph_stats(G, area=G.graph["area"]))
-    return G
+    if not force and load_cached(folder_cache, city_name, key) is not None:
+        return
+    manifest = StepManifest(
+        folder + "manifest.jsonl",
+        "01_prepare_graphs",
+        city_name,
+        profile_step,
+    )
+    with manifest.step("load_graph") as step:
+        G = load_graph_parquet(folder_graph_OSM + city_name)
+        poly = read_gpkg(file_poly)
+        step["graph"] = G
+    G = make_graph_compatible(G, poly=poly, step=manifest.step)
+    with manifest.step("save_graph", G):
+        ox.save_graphml(G, folder_sb + "/" + city_name + ".graphml")
+        save_graph_parquet(G, folder_sb + "/" + city_name)
+    save_cached(folder_cache, city_name, key, outputs)
 
 
 if __name__ == "__main__":
-    folder_graph_OSM = "./data/processed/city_partners_public/graphs_OSM/"
-    folder_graph = "./data/processed/city_partners_public/graphs_SB/"
-    folder_plot = "./plots/city_partners_public/"
-    sb.config.Config.GHSL_DIR = "./data/raw"
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--force", action="store_true", help="Ignore the cache and run all cities."
+    )
+    parser.add_argument(
+        "--profile-step",
+        default=None,
+        help="Name of a step to profile with cProfile for every city, see profiling.py.",
+    )
+    args = parser.parse_args()
+    folder_graph_OSM = FOLDER_CITY_PARTNERS + "graphs_OSM/"
     # Get all files
     for file_graph in tqdm.tqdm(
         sorted(
@@ -73,10 +83,9 @@ if __name__ == "__main__":
         )
     ):
         city_name = file_graph.split(".")[0]
-        folder_sb = folder_graph + city_name
-        if not os.path.exists(folder_sb):
-            os.makedirs(folder_sb)
-        G = load_graphml_dtypes(folder_graph_OSM + file_graph)
-        poly = gpd.read_file(f"./data/raw/city_partners_public/{city_name}.gpkg")
-        G = make_graph_compatible(G, poly=poly)
-        ox.save_graphml(G, folder_sb + "/" + city_name + ".graphml")
+        prepare_graph(
+            city_name,
+            f"./data/raw/city_partners_public/{city_name}.gpkg",
+            force=args.force,
+            profile_step=args.profile_step,
+        )
@@ -3,44 +3,73 @@
 Get some data on all graphs
 """
 
+import argparse
+import numpy as np
 import pandas as pd
-import geopandas as gpd
 import os
-from superblockify.utils import load_graphml_dtypes
+from cache import stage_key, load_cached, save_cached
+from graph_io import graph_parquet_paths, load_edge_columns, load_graph_attributes
+from gpkg_io import read_gpkg
+from parallel import run_jobs, print_failed_jobs
+from profiling import StepManifest
+from utils import FOLDER_CITY_PARTNERS
 
 
-if __name__ == "__main__":
-    folder_graph_names = "./data/processed/city_partners_public/graphs_OSM/"
-    folder_graph = "./data/processed/city_partners_public/graphs_SB/"
-    folder_poly = "./data/raw/city_partners_public/"
-    all_arr = []
-    # Get all files
-    for file_graph in [
-        filename
-        for filename in os.listdir(folder_graph_names)
-        if filename.endswith(".graphml")
-    ]:
-        city_name = file_graph.split(".")[0]
-        folder_sb = folder_graph + city_name
-        if not os.path.exists(folder_sb):
-            os.makedirs(folder_sb)
-        G = load_graphml_dtypes(folder_graph + city_name + "/" + city_name + ".graphml")
-        poly = gpd.read_file(folder_poly + city_name + ".gpkg")
-        poly = poly.to_crs(G.graph["crs"])
+def metadata_key(city_name, file_poly, folder=FOLDER_CITY_PARTNERS):
+    "Get the cache key of city_metadata, from the edge table of city_name in folder and its polygon at file_poly."
+    return stage_key(
+        "get_metadata",
+        [
+            *graph_parquet_paths(folder + f"graphs_SB/{city_name}/{city_name}"),
+            file_poly,
+        ],
+    )
+
+
+def city_metadata(
+    city_name, file_poly, force=False, profile_step=None, folder=FOLDER_CITY_PARTNERS
+):
+    "Save in the cache the row of metadata of city_name, unless it is already there."
+    folder_cache = folder + "cache/02_get_metadata/"
+    key = metadata_key(city_name, file_poly, folder)
+    if not force and load_cached(folder_cache, city_name, key) is not None:
+        return
+    file_graph_sb = folder + f"graphs_SB/{city_name}/{city_name}"
+    manifest = StepManifest(
+        folder + "manifest.jsonl",
+        "02_get_metadata",
+        city_name,
+        profile_step,
+    )
+    with manifest.step("metadata"):
+        edges = load_edge_columns(file_graph_sb, ["length", "population"])
+        poly = read_gpkg(file_poly)
+        poly = poly.to_crs(load_graph_attributes(file_graph_sb)["crs"])
         area = poly.geometry[0].area / 1000000
-        roadsum = sum([G.edges[e]["length"] for e in G.edges]) / 1000
-        popsum = sum([G.edges[e]["population"] for e in G.edges])
-        all_arr.append(
-            [
-                city_name,
-                area,
-                len(G.edges),
-                roadsum,
-                roadsum / area,
-                popsum,
-                popsum / area,
-            ]
+        roadsum = float(np.sum(edges["length"])) / 1000
+        popsum = float(np.sum(edges["population"]))
+        row = [
+            city_name,
+            area,
+            len(edges["length"]),
+            roadsum,
+            roadsum / area,
+            popsum,
+            popsum / area,
+        ]
+    save_cached(folder_cache, city_name, key, data=row)
+
+
+def save_metadata(file_polys, folder=FOLDER_CITY_PARTNERS):
+    "Save in folder the table of metadata of the cities of file_polys from the cache."
+    folder_cache = folder + "cache/02_get_metadata/"
+    all_arr = []
+    for city_name, file_poly in file_polys.items():
+        record = load_cached(
+            folder_cache, city_name, metadata_key(city_name, file_poly, folder)
         )
+        if record is not None:
+            all_arr.append(record["data"])
     df = pd.DataFrame(
         all_arr,
         columns=[
@@ -53,4 +82,42 @@ if __name__ == "__main__":
             "Population density",
         ],
     )
-    df.to_json("./data/processed/city_partners_public/metadata_cities.json")
+    df.to_json(folder + "metadata_cities.json")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--force", action="store_true", help="Ignore the cache and run all cities."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, default to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--profile-step",
+        default=None,
+        help="Name of a step to profile with cProfile for every city, see profiling.py.",
+    )
+    args = parser.parse_args()
+    folder_graph_names = FOLDER_CITY_PARTNERS + "graphs_OSM/"
+    city_names = sorted(
+        [
+            filename.split(".")[0]
+            for filename in os.listdir(folder_graph_names)
+            if filename.endswith(".graphml")
+        ]
+    )
+    file_polys = {
+        city_name: f"./data/raw/city_partners_public/{city_name}.gpkg"
+        for city_name in city_names
+    }
+    jobs = [
+        (city_name, file_poly, args.force, args.profile_step)
+        for city_name, file_poly in file_polys.items()
+    ]
+    failed = run_jobs(city_metadata, jobs, workers=args.workers)
+    print_failed_jobs(failed, len(jobs))
+    save_metadata(file_polys)
@@ -3,201 +3,236 @@
 Run Superblockify on {city_name} private limits.
 """
 
+import argparse
 import os
+
+# Imported before superblockify to set the threading layer of numba, see parallel.py
+from parallel import run_jobs, print_failed_jobs
 import superblockify as sb
-import shapely
-import tqdm
 import osmnx as ox
 import pandas as pd
-import numpy as np
+from superblockify.graph_stats import calculate_component_metrics
+from cache import stage_key, load_cached, save_cached
+from distances import path_distance_matrix, relative_travel, restricted_partitions
+from graph_io import save_graph_parquet, graph_parquet_paths
+from profiling import StepManifest
+from utils import (
+    FOLDER_CITY_PARTNERS,
+    GHSL_DIR,
+    LTN_FILTER,
+    decode_cells,
+    is_ltn,
+    ltn_labels,
+    ltn_overlay,
+    set_ltn_labels,
+)
+
+
+PARTITIONERS = {
+    "residential": sb.ResidentialPartitioner,
+    "betweenness": sb.BetweennessPartitioner,
+}
 
 
-def avoid_zerodiv_matrix(num_mat, den_mat):
+def superblockify_city(
+    city_name,
+    part_name,
+    force=False,
+    float32=False,
+    sample=None,
+    population_weighted=False,
+    seed=0,
+    profile_step=None,
+    ltn_filter=LTN_FILTER,
+    folder=FOLDER_CITY_PARTNERS,
+    ghsl_dir=GHSL_DIR,
+):
     """
-    Divide one matrix by another while replacing numerator divided by 0 by 0.
-    Example: [[1, 2],   divided by [[1, 0],    will give out [[1, 0],
-              [3, 4]]               [6, 0]]                   [0.5, 0]]
+    Run the partitioner part_name on city_name and save its results, unless they are cached.
+    With float32 or sample, the metrics of superblockify are skipped, see relative_travel.
     """
-    return np.divide(
-        num_mat,
-        den_mat,
-        out=np.zeros_like(num_mat),
-        where=((den_mat != 0) & (den_mat != np.inf) & (num_mat != np.inf)),
+    sb.config.Config.GHSL_DIR = ghsl_dir
+    sb.config.Config.GRAPH_DIR = folder + "graphs_SB/" + city_name
+    sb.config.Config.RESULTS_DIR = sb.config.Config.GRAPH_DIR + "/sb_results"
+    folder_cache = folder + "cache/03_superblockify/"
+    folder_res = sb.config.Config.RESULTS_DIR + f"/{city_name}_{part_name}/"
+    outputs = [
+        folder_res + "all_partitions.json",
+        folder_res + "filt_partitions.json",
+        folder_res + f"{city_name}_all.graphml",
+        folder_res + f"{city_name}_filt.graphml",
+        *graph_parquet_paths(folder_res + f"{city_name}_all"),
+        *graph_parquet_paths(folder_res + f"{city_name}_filt"),
+        sb.config.Config.GRAPH_DIR + "/" + city_name + "_" + part_name + ".gpkg",
+    ]
+    key = stage_key(
+        "superblockify",
+        [sb.config.Config.GRAPH_DIR + "/" + city_name + ".graphml"],
+        {
+            "partitioner": part_name,
+            "ltn_filter": list(ltn_filter),
+            "float32": float32,
+            "sample": sample,
+            "population_weighted": population_weighted,
+            "seed": seed,
+        },
     )
+    record = load_cached(folder_cache, city_name + "_" + part_name, key)
+    if not force and record is not None:
+        return
+    manifest = StepManifest(
+        folder + "manifest.jsonl",
+        "03_superblockify_" + part_name,
+        city_name,
+        profile_step,
+    )
+    with manifest.step("load_graph") as step:
+        part = PARTITIONERS[part_name](
+            name=city_name + "_" + part_name,
+            city_name=city_name,
+            search_str=city_name,
+            unit="time",
+        )
+        decode_cells(part.graph)
+        step["graph"] = part.graph
+    # The metrics of superblockify hold full float64 distance and predecessor matrices
+    calculate_metrics = not float32 and sample is None
+    with manifest.step("part.run", part.graph):
+        part.run(
+            calculate_metrics=calculate_metrics,
+            make_plots=False,
+            replace_max_speeds=False,
+        )
+        if not calculate_metrics:
+            # Area and number of nodes of the partitions, to filter the LTNs
+            calculate_component_metrics(part.get_ltns())
+    with manifest.step("part.save", part.graph):
+        part.save()
+    with manifest.step("ltn_labels", part.graph):
+        G = part.graph.copy()
+        all_part = pd.DataFrame(part.partitions)
+        filt_part = all_part[
+            is_ltn(all_part["area"], all_part["n"], *ltn_filter)
+        ].reset_index(drop=True)
+        # Label edges once, both graphs saved below are derived from the labels
+        overlay = ltn_overlay(part)
+        labels_all = ltn_labels(overlay)
+        labels_filt = ltn_labels(overlay, filt_part["name"])
+        partitions_travel = part.get_partition_nodes()
+    # The distance matrix of all pairs is not needed when sampling origins
+    dg = None
+    if sample is None:
+        with manifest.step("path_distance_matrix", G):
+            dg = path_distance_matrix(G, "length", folder + "cache/distances/")
+    travel = {}
+    for suffix, labels, names in [
+        ["filt", labels_filt, filt_part["name"]],
+        ["all", labels_all, None],
+    ]:
+        with manifest.step(f"relative_travel_{suffix}", G):
+            travel[suffix] = relative_travel(
+                G,
+                restricted_partitions(G, partitions_travel, labels, names),
+                dg,
+                float32=float32,
+                sample=sample,
+                population_weighted=population_weighted,
+                seed=seed,
+            )
+    with manifest.step("save_graphs", G):
+        filt_part = filt_part.drop("subgraph", axis=1)
+        all_part = all_part.drop("subgraph", axis=1)
+        all_part.to_json(folder_res + "all_partitions.json")
+        filt_part.to_json(folder_res + "filt_partitions.json")
+        for suffix, labels in [["all", labels_all], ["filt", labels_filt]]:
+            set_ltn_labels(G, labels)
+            G.graph.update(travel[suffix])
+            ox.save_graphml(G, folder_res + f"{city_name}_{suffix}.graphml")
+            save_graph_parquet(G, folder_res + f"{city_name}_{suffix}")
+    with manifest.step("save_to_gpkg", part.graph):
+        sb.save_to_gpkg(
+            part,
+            save_path=sb.config.Config.GRAPH_DIR
+            + "/"
+            + city_name
+            + "_"
+            + part_name
+            + ".gpkg",
+            ltn_boundary=True,
+        )
+    save_cached(folder_cache, city_name + "_" + part_name, key, outputs)
 
 
 if __name__ == "__main__":
-    folder_graph_OSM = "./data/processed/city_partners_public/graphs_OSM/"
-    folder_graph = "./data/processed/city_partners_public/graphs_SB/"
-    folder_plot = "./plots/city_partners_public/"
-    sb.config.Config.GHSL_DIR = "./data/raw"
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, default to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Maximal time in seconds for a single city and partitioner.",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=float,
+        default=None,
+        help="Maximal memory in GB for a single city and partitioner.",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Ignore the cache and run all cities."
+    )
+    parser.add_argument(
+        "--float32",
+        action="store_true",
+        help="Compute restricted distances in single precision and skip the metrics of superblockify, to lower the peak memory. The betweenness partitioner still needs the full distance matrix of superblockify.",
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=None,
+        help="Estimate relative travel from this number of random origins instead of all nodes, and skip the metrics of superblockify. The betweenness partitioner still needs the full distance matrix of superblockify.",
+    )
+    parser.add_argument(
+        "--population-weighted",
+        action="store_true",
+        help="Draw the origins of --sample proportionally to the population.",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed of the origins of --sample."
+    )
+    parser.add_argument(
+        "--profile-step",
+        default=None,
+        help="Name of a step to profile with cProfile for every city, see profiling.py.",
+    )
+    args = parser.parse_args()
+    folder_graph_OSM = FOLDER_CITY_PARTNERS + "graphs_OSM/"
     # Get all files
-    for file_graph in tqdm.tqdm(
-        sorted(
-            [
-                filename
-                for filename in os.listdir(folder_graph_OSM)
-                if filename.endswith(".graphml")
-            ]
-        )
-    ):
-        city_name = file_graph.split(".")[0]
-        G = sb.utils.load_graphml_dtypes(
-            f"./data/processed/city_partners_public/graphs_SB/{city_name}/{city_name}.graphml"
-        )
-        sb.config.Config.GRAPH_DIR = (
-            "./data/processed/city_partners_public/graphs_SB/" + city_name
+    jobs = [
+        (
+            filename.split(".")[0],
+            part_name,
+            args.force,
+            args.float32,
+            args.sample,
+            args.population_weighted,
+            args.seed,
+            args.profile_step,
         )
-        sb.config.Config.RESULTS_DIR = sb.config.Config.GRAPH_DIR + "/sb_results"
-        for part_name, func in [
-            ["residential", sb.ResidentialPartitioner],
-            ["betweenness", sb.BetweennessPartitioner],
-        ]:
-            part = func(
-                name=city_name + "_" + part_name,
-                city_name=city_name,
-                search_str=city_name,
-                unit="time",
-            )
-            for e in part.graph.edges:
-                part.graph.edges[e]["cell"] = shapely.from_wkt(
-                    part.graph.edges[e]["cell"]
-                )
-            part.run(
-                calculate_metrics=True,
-                make_plots=False,
-                replace_max_speeds=False,
-            )
-            part.save()
-            G = part.graph.copy()
-            G_all = G.copy()
-            G_filt = G.copy()
-            filt_part = []
-            all_part = pd.DataFrame(part.partitions)
-            for p in part.partitions:
-                if (p["area"] > 25600) & (p["area"] < 921600) & (p["n"] > 5):
-                    filt_part.append(p)
-                    for e in p["subgraph"].edges:
-                        for attr in p["subgraph"].edges[e]:
-                            G_filt.edges[e][attr] = p["subgraph"].edges[e][attr]
-                        G_filt.edges[e]["ltn_name"] = p["name"]
-                        G_filt.edges[e]["in_ltn"] = True
-                else:
-                    for e in p["subgraph"].edges:
-                        for attr in p["subgraph"].edges[e]:
-                            G_filt.edges[e][attr] = p["subgraph"].edges[e][attr]
-                        G_filt.edges[e]["ltn_name"] = None
-                        G_filt.edges[e]["in_ltn"] = False
-                for e in p["subgraph"].edges:
-                    for attr in p["subgraph"].edges[e]:
-                        G_all.edges[e][attr] = p["subgraph"].edges[e][attr]
-                    G_all.edges[e]["ltn_name"] = p["name"]
-                    G_all.edges[e]["in_ltn"] = True
-            for H in [G_all, G_filt]:
-                for e in part.sparsified.edges:
-                    for attr in part.sparsified.edges[e]:
-                        H.edges[e][attr] = part.sparsified.edges[e][attr]
-                    H.edges[e]["ltn_name"] = None
-                    H.edges[e]["in_ltn"] = False
-            filt_part = pd.DataFrame(filt_part)
-            partitions_travel = part.get_partition_nodes()
-            partitions_travel_filt = {
-                partition["name"]: {
-                    "subgraph": partition["subgraph"],
-                    "nodes": list(
-                        partition["nodes"]
-                    ),  # exclusive nodes inside the subgraph
-                    "nodelist": list(
-                        partition["subgraph"]
-                    ),  # also nodes shared with the
-                    # sparsified graph or on partition boundaries
-                }
-                for partition in partitions_travel
-                if partition["name"] in list(filt_part["name"])
-            }
-            filt_sparsified = G.edge_subgraph(
-                [e for e in G_filt.edges if G_filt.edges[e]["in_ltn"] is False]
-            )
-            partitions_travel_filt["sparsified"] = {
-                "subgraph": filt_sparsified,
-                "nodes": list(filt_sparsified.nodes),
-                "nodelist": list(filt_sparsified.nodes),
-            }
-            dg, _ = sb.metrics.distances.calculate_path_distance_matrix(
-                G, weight="length"
-            )
-            dgr, _ = sb.metrics.distances.shortest_paths_restricted(
-                G, partitions_travel_filt, "length", list(G.nodes)
-            )
-            rel_travel = avoid_zerodiv_matrix(dgr, dg)
-            G_filt.graph["avg_rel_travel"] = np.sum(rel_travel) / np.count_nonzero(
-                rel_travel
-            )
-            max_detour = np.where(rel_travel == np.max(rel_travel))
-            G_filt.graph["max_detour"] = (
-                dgr[max_detour[0][0]][max_detour[1][0]]
-                - dg[max_detour[0][0]][max_detour[1][0]]
-            )
-            partitions_travel_all = {
-                partition["name"]: {
-                    "subgraph": partition["subgraph"],
-                    "nodes": list(
-                        partition["nodes"]
-                    ),  # exclusive nodes inside the subgraph
-                    "nodelist": list(
-                        partition["subgraph"]
-                    ),  # also nodes shared with the
-                    # sparsified graph or on partition boundaries
-                }
-                for partition in partitions_travel
-            }
-            all_sparsified = G.edge_subgraph(
-                [e for e in G_all.edges if G_all.edges[e]["in_ltn"] is False]
-            )
-            partitions_travel_all["sparsified"] = {
-                "subgraph": all_sparsified,
-                "nodes": list(all_sparsified.nodes),
-                "nodelist": list(all_sparsified.nodes),
-            }
-            dgr, _ = sb.metrics.distances.shortest_paths_restricted(
-                G, partitions_travel_all, "length", list(G.nodes)
-            )
-            rel_travel = avoid_zerodiv_matrix(dgr, dg)
-            G_all.graph["avg_rel_travel"] = np.sum(rel_travel) / np.count_nonzero(
-                rel_travel
-            )
-            max_detour = np.where(rel_travel == np.max(rel_travel))
-            G_all.graph["max_detour"] = (
-                dgr[max_detour[0][0]][max_detour[1][0]]
-                - dg[max_detour[0][0]][max_detour[1][0]]
-            )
-            filt_part = filt_part.drop("subgraph", axis=1)
-            all_part = all_part.drop("subgraph", axis=1)
-            all_part.to_json(
-                sb.config.Config.RESULTS_DIR
-                + f"/{city_name}_{part_name}/all_partitions.json"
-            )
-            filt_part.to_json(
-                sb.config.Config.RESULTS_DIR
-                + f"/{city_name}_{part_name}/filt_partitions.json"
-            )
-            ox.save_graphml(
-                G_all,
-                sb.config.Config.RESULTS_DIR
-                + f"/{city_name}_{part_name}/{city_name}_all.graphml",
-            )
-            ox.save_graphml(
-                G_filt,
-                sb.config.Config.RESULTS_DIR
-                + f"/{city_name}_{part_name}/{city_name}_filt.graphml",
-            )
-            sb.save_to_gpkg(
-                part,
-                save_path=sb.config.Config.GRAPH_DIR
-                + "/"
-                + city_name
-                + "_"
-                + part_name
-                + ".gpkg",
-                ltn_boundary=True,
-            )
+        for filename in sorted(os.listdir(folder_graph_OSM))
+        if filename.endswith(".graphml")
+        for part_name in PARTITIONERS
+    ]
+    failed = run_jobs(
+        superblockify_city,
+        jobs,
+        workers=args.workers,
+        timeout=args.timeout,
+        max_memory=None if args.max_memory is None else int(args.max_memory * 1e9),
+    )
+    print_failed_jobs(failed, len(jobs))
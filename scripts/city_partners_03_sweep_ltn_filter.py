@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Evaluate a grid of LTN filters (min_area, max_area, min_n) on the saved partitions of city_partners_03_superblockify.
+"""
+
+import argparse
+import itertools
+import os
+
+# Imported before superblockify to set the threading layer of numba, see parallel.py
+from parallel import run_jobs, print_failed_jobs
+import numpy as np
+import pandas as pd
+import superblockify as sb
+from superblockify.partitioning import BasePartitioner
+from cache import stage_key, load_cached, save_cached
+from distances import path_distance_matrix, relative_travel, restricted_partitions
+from utils import (
+    FOLDER_CITY_PARTNERS,
+    GHSL_DIR,
+    LTN_MIN_AREA,
+    LTN_MAX_AREA,
+    LTN_MIN_N,
+    decode_cells,
+    is_ltn,
+    ltn_labels,
+    ltn_overlay,
+)
+
+
+COL_NAMES = [
+    "Cities",
+    "Minimal area",
+    "Maximal area",
+    "Minimal number of nodes",
+    "Amount of superblocks",
+    "Share of streets within superblocks",
+    "Share of the population within superblocks",
+    "Area of pacified streets",
+    "Average travel distance increase",
+    "Maximal detour",
+]
+
+
+def sweep_key(city_name, part_name, grid, sample=None, seed=0):
+    "Get the cache key of sweep_city, from the saved partitioner and the parameters."
+    name = city_name + "_" + part_name
+    return stage_key(
+        "sweep_ltn_filter",
+        [
+            FOLDER_CITY_PARTNERS
+            + f"graphs_SB/{city_name}/sb_results/{name}/{name}.partitioner"
+        ],
+        {"grid": grid, "sample": sample, "seed": seed},
+    )
+
+
+def sweep_city(city_name, part_name, grid, force=False, sample=None, seed=0):
+    """
+    Save in the cache the results of all filters of grid on part_name of city_name, unless they are there.
+    Relative travel is computed once per distinct set of kept partitions.
+    """
+    sb.config.Config.GHSL_DIR = GHSL_DIR
+    sb.config.Config.GRAPH_DIR = FOLDER_CITY_PARTNERS + "graphs_SB/" + city_name
+    sb.config.Config.RESULTS_DIR = sb.config.Config.GRAPH_DIR + "/sb_results"
+    folder_cache = FOLDER_CITY_PARTNERS + "cache/03_sweep_ltn_filter/"
+    name = city_name + "_" + part_name
+    key = sweep_key(city_name, part_name, grid, sample, seed)
+    record = load_cached(folder_cache, name, key)
+    if not force and record is not None:
+        return
+    part = BasePartitioner.load(name)
+    G = part.graph
+    decode_cells(G)
+    overlay = ltn_overlay(part)
+    all_part = pd.DataFrame(part.partitions)
+    # Sums of each partition, shared by all filters
+    edges = pd.DataFrame(
+        [
+            [u, v, k, d["length"], d["population"], d["cell_area"]]
+            for u, v, k, d in G.edges(keys=True, data=True)
+        ],
+        columns=["u", "v", "key", "length", "population", "cell_area"],
+    ).set_index(["u", "v", "key"])
+    sums = edges.join(overlay).groupby("ltn_name").sum()
+    sums = sums.reindex(all_part["name"], fill_value=0).to_numpy()
+    totals = edges.sum().to_numpy()
+    partition_nodes = part.get_partition_nodes()
+    dg = None
+    if sample is None:
+        dg = path_distance_matrix(
+            G, "length", FOLDER_CITY_PARTNERS + "cache/distances/"
+        )
+    travel = {}
+    rows = []
+    for min_area, max_area, min_n in grid:
+        kept = np.asarray(
+            is_ltn(all_part["area"], all_part["n"], min_area, max_area, min_n)
+        )
+        names = frozenset(all_part["name"][kept])
+        if names not in travel:
+            travel[names] = relative_travel(
+                G,
+                restricted_partitions(
+                    G, partition_nodes, ltn_labels(overlay, names), names
+                ),
+                dg,
+                sample=sample,
+                seed=seed,
+            )
+        shares = 100 * sums[kept].sum(axis=0) / totals
+        rows.append(
+            [
+                city_name,
+                min_area,
+                max_area,
+                min_n,
+                len(names),
+                round(float(shares[0]), 1),
+                round(float(shares[1]), 1),
+                round(float(shares[2]), 1),
+                round(100 * (float(travel[names]["avg_rel_travel"]) - 1), 5),
+                round(float(travel[names]["max_detour"]) / 1000, 1),
+            ]
+        )
+    save_cached(folder_cache, name, key, data=rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--min-area",
+        type=float,
+        nargs="+",
+        default=[LTN_MIN_AREA],
+        help="Minimal areas of LTNs in m² to try.",
+    )
+    parser.add_argument(
+        "--max-area",
+        type=float,
+        nargs="+",
+        default=[LTN_MAX_AREA],
+        help="Maximal areas of LTNs in m² to try.",
+    )
+    parser.add_argument(
+        "--min-n",
+        type=int,
+        nargs="+",
+        default=[LTN_MIN_N],
+        help="Minimal numbers of nodes of LTNs to try.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, default to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Ignore the cache and run all cities."
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=None,
+        help="Estimate relative travel from this number of random origins instead of all nodes.",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed of the origins of --sample."
+    )
+    args = parser.parse_args()
+    grid = tuple(itertools.product(args.min_area, args.max_area, args.min_n))
+    folder_graph_OSM = FOLDER_CITY_PARTNERS + "graphs_OSM/"
+    folder_cache = FOLDER_CITY_PARTNERS + "cache/03_sweep_ltn_filter/"
+    city_names = [
+        filename.split(".")[0]
+        for filename in sorted(os.listdir(folder_graph_OSM))
+        if filename.endswith(".graphml")
+    ]
+    part_names = ["residential", "betweenness"]
+    jobs = [
+        (city_name, part_name, grid, args.force, args.sample, args.seed)
+        for city_name in city_names
+        for part_name in part_names
+    ]
+    failed = run_jobs(sweep_city, jobs, workers=args.workers)
+    print_failed_jobs(failed, len(jobs))
+    for part_name in part_names:
+        all_arr = []
+        for city_name in city_names:
+            job = (city_name, part_name, grid, args.force, args.sample, args.seed)
+            if job in failed:
+                continue
+            record = load_cached(
+                folder_cache,
+                city_name + "_" + part_name,
+                sweep_key(city_name, part_name, grid, args.sample, args.seed),
+            )
+            all_arr.extend(record["data"])
+        df = pd.DataFrame(all_arr, columns=COL_NAMES)
+        df.to_json(FOLDER_CITY_PARTNERS + f"sweep_ltn_filter_{part_name}.json")
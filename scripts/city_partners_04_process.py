@@ -3,19 +3,117 @@
 Analyze the obtained results from superblockifying cities.
 """
 
+import argparse
 import pandas as pd
 import os
-from superblockify.utils import load_graphml_dtypes
 import json
-import tqdm
-import shapely
+from cache import stage_key, load_cached, save_cached
+from graph_io import graph_parquet_paths, load_edge_columns, load_graph_attributes
+from parallel import run_jobs, print_failed_jobs
+from profiling import StepManifest
+from utils import FOLDER_CITY_PARTNERS
 
 
-if __name__ == "__main__":
-    folder_graph_names = "./data/processed/city_partners_public/graphs_OSM/"
-    folder_graph = "./data/processed/city_partners_public/graphs_SB/"
-    # Get all files
-    for part_name in ["betweenness", "residential"]:
+PART_NAMES = ["betweenness", "residential"]
+FILT_VALS = ["filt", "all"]
+
+
+def city_row(edges, graph, city_name, n_ltns, part_name):
+    "Get the row of results of city_name from the edge columns and attributes of its graph."
+    # TODO Solve issue of edges not in partitions and not in sparsified, missing in_ltn is False
+    in_ltn = edges["in_ltn"].astype(bool)
+    col_to_add = [
+        city_name,
+        n_ltns,
+        *[
+            round(100 * float(edges[name][in_ltn].sum() / edges[name].sum()), 1)
+            for name in ["length", "population", "cell_area"]
+        ],
+        round(100 * (float(graph["avg_rel_travel"]) - 1), 5),
+        round(float(graph["max_detour"]) / 1000, 1),
+    ]
+    if part_name == "betweenness":
+        non_res = edges["highway"] != "residential"
+        col_to_add.append(
+            round(
+                100
+                * float(
+                    edges["length"][non_res & in_ltn].sum()
+                    / edges["length"][non_res].sum()
+                ),
+                1,
+            )
+        )
+    return col_to_add
+
+
+def process_key(city_name, part_names=PART_NAMES, folder=FOLDER_CITY_PARTNERS):
+    "Get the cache key of process_city for city_name and the partitioners part_names."
+    files = []
+    for part_name in part_names:
+        folder_sb = (
+            folder + f"graphs_SB/{city_name}/sb_results/{city_name}_{part_name}/"
+        )
+        for filt_val in FILT_VALS:
+            files.extend(graph_parquet_paths(folder_sb + f"{city_name}_{filt_val}"))
+            files.append(folder_sb + f"{filt_val}_partitions.json")
+    return stage_key("process", files, {"part_names": part_names, "filt": FILT_VALS})
+
+
+def process_city(
+    city_name,
+    force=False,
+    profile_step=None,
+    part_names=PART_NAMES,
+    folder=FOLDER_CITY_PARTNERS,
+):
+    "Save in the cache the rows of results of city_name, unless they are already there."
+    folder_cache = folder + "cache/04_process/"
+    key = process_key(city_name, part_names, folder)
+    if not force and load_cached(folder_cache, city_name, key) is not None:
+        return
+    manifest = StepManifest(
+        folder + "manifest.jsonl",
+        "04_process",
+        city_name,
+        profile_step,
+    )
+    rows = {}
+    for part_name in part_names:
+        folder_sb = (
+            folder + f"graphs_SB/{city_name}/sb_results/{city_name}_{part_name}/"
+        )
+        with manifest.step(f"city_rows_{part_name}"):
+            edges = load_edge_columns(
+                folder_sb + f"{city_name}_{FILT_VALS[0]}",
+                ["length", "population", "cell_area", "highway"],
+            )
+            for filt_val in FILT_VALS:
+                filepath = folder_sb + f"{city_name}_{filt_val}"
+                edges["in_ltn"] = load_edge_columns(filepath, ["in_ltn"])["in_ltn"]
+                with open(folder_sb + f"{filt_val}_partitions.json") as f:
+                    n_ltns = len(json.load(f)["name"])
+                rows[f"{part_name}_{filt_val}"] = city_row(
+                    edges,
+                    load_graph_attributes(filepath),
+                    city_name,
+                    n_ltns,
+                    part_name,
+                )
+    save_cached(folder_cache, city_name, key, data=rows)
+
+
+def save_results(city_names, part_names=PART_NAMES, folder=FOLDER_CITY_PARTNERS):
+    "Save in folder the tables of results of city_names from the rows in the cache."
+    folder_cache = folder + "cache/04_process/"
+    rows = {}
+    for city_name in city_names:
+        record = load_cached(
+            folder_cache, city_name, process_key(city_name, part_names, folder)
+        )
+        if record is not None:
+            rows[city_name] = record["data"]
+    for part_name in part_names:
         col_names = [
             "Cities",
             "Amount of superblocks",
@@ -27,78 +125,40 @@ if __name__ == "__main__":
         ]
         if part_name == "betweenness":
             col_names.append("Share of non-residential streets in superblocks")
-        for filt_val in ["filt", "all"]:
-            all_arr = []
-            for file_graph in tqdm.tqdm(
-                sorted(
-                    [
-                        filename
-                        for filename in os.listdir(folder_graph_names)
-                        if filename.endswith(".graphml")
-                    ]
-                )
-            ):
-                city_name = file_graph.split(".")[0]
-                folder_sb = (
-                    folder_graph + f"{city_name}/sb_results/{city_name}_{part_name}/"
-                )
-                G = load_graphml_dtypes(folder_sb + f"{city_name}_{filt_val}.graphml")
-                # TODO Solve issue of edges not in partitions and not in sparsified
-                for e in G.edges:
-                    if "in_ltn" not in G.edges[e]:
-                        G.edges[e]["in_ltn"] = "False"
-                ltn_streets = [e for e in G.edges if G.edges[e]["in_ltn"] == "True"]
-                roadsum = round(
-                    100
-                    * sum([G.edges[e]["length"] for e in ltn_streets])
-                    / sum([G.edges[e]["length"] for e in G.edges]),
-                    1,
-                )
-                popsum = round(
-                    100
-                    * sum([G.edges[e]["population"] for e in ltn_streets])
-                    / sum([G.edges[e]["population"] for e in G.edges]),
-                    1,
-                )
-                areasum = round(
-                    100
-                    * sum(
-                        [shapely.from_wkt(G.edges[e]["cell"]).area for e in ltn_streets]
-                    )
-                    / sum([shapely.from_wkt(G.edges[e]["cell"]).area for e in G.edges]),
-                    1,
-                )
-                with open(folder_sb + f"{filt_val}_partitions.json") as f:
-                    partitions = json.load(f)
-                col_to_add = [
-                    city_name,
-                    len(partitions["name"]),
-                    roadsum,
-                    popsum,
-                    areasum,
-                    round(100 * (float(G.graph["avg_rel_travel"]) - 1), 5),
-                    round(float(G.graph["max_detour"]) / 1000, 1),
-                ]
-                if part_name == "betweenness":
-                    non_res_streets = [
-                        e for e in G.edges if G.edges[e]["highway"] != "residential"
-                    ]
-                    col_to_add.append(
-                        round(
-                            100
-                            * sum(
-                                [
-                                    G.edges[e]["length"]
-                                    for e in non_res_streets
-                                    if e in ltn_streets
-                                ]
-                            )
-                            / sum([G.edges[e]["length"] for e in non_res_streets]),
-                            1,
-                        )
-                    )
-                all_arr.append(col_to_add)
-            df = pd.DataFrame(all_arr, columns=col_names)
-            df.to_json(
-                f"./data/processed/city_partners_public/results_cities_{part_name}_{filt_val}.json"
+        for filt_val in FILT_VALS:
+            df = pd.DataFrame(
+                [city_rows[f"{part_name}_{filt_val}"] for city_rows in rows.values()],
+                columns=col_names,
             )
+            df.to_json(folder + f"results_cities_{part_name}_{filt_val}.json")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--force", action="store_true", help="Ignore the cache and run all cities."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, default to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--profile-step",
+        default=None,
+        help="Name of a step to profile with cProfile for every city, see profiling.py.",
+    )
+    args = parser.parse_args()
+    folder_graph_names = FOLDER_CITY_PARTNERS + "graphs_OSM/"
+    city_names = sorted(
+        [
+            filename.split(".")[0]
+            for filename in os.listdir(folder_graph_names)
+            if filename.endswith(".graphml")
+        ]
+    )
+    jobs = [(city_name, args.force, args.profile_step) for city_name in city_names]
+    failed = run_jobs(process_city, jobs, workers=args.workers)
+    print_failed_jobs(failed, len(jobs))
+    save_results(city_names)
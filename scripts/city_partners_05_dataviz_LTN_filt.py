@@ -4,14 +4,65 @@ Filter all LTNs for visualization purposes.
 """
 
 
+import argparse
 import os
-import geopandas as gpd
 import tqdm
+from cache import stage_key, load_cached, save_cached
+from profiling import StepManifest
+from gpkg_io import read_gpkg, write_gpkg
+from utils import FOLDER_CITY_PARTNERS, LTN_FILTER, is_ltn_sql
+
+
+def filter_ltns(
+    city_name,
+    part_name,
+    force=False,
+    profile_step=None,
+    ltn_filter=LTN_FILTER,
+    folder=FOLDER_CITY_PARTNERS,
+):
+    "Save the LTNs of city_name for part_name kept by ltn_filter, unless they are cached."
+    folder_graph = folder + "graphs_SB/"
+    folder_cache = folder + "cache/05_dataviz_LTN_filt/"
+    file_ltns = folder_graph + f"{city_name}/{city_name}_{part_name}.gpkg"
+    file_filt = folder_graph + f"{city_name}/{city_name}_{part_name}_filt_ltns.gpkg"
+    key = stage_key(
+        "dataviz_LTN_filt",
+        [file_ltns],
+        {"ltn_filter": list(ltn_filter)},
+    )
+    cache_name = f"{city_name}_{part_name}"
+    if not force and load_cached(folder_cache, cache_name, key) is not None:
+        return
+    manifest = StepManifest(
+        folder + "manifest.jsonl",
+        "05_dataviz_LTN_filt",
+        city_name,
+        profile_step,
+    )
+    min_area, max_area, min_n = ltn_filter
+    with manifest.step(f"filter_ltns_{part_name}"):
+        df_filt = read_gpkg(
+            file_ltns,
+            "ltns",
+            where=is_ltn_sql(min_area=min_area, max_area=max_area, min_n=min_n),
+        )
+        write_gpkg(df_filt, file_filt)
+    save_cached(folder_cache, cache_name, key, [file_filt])
 
 
 if __name__ == "__main__":
-    folder_graph_names = "./data/processed/city_partners_public/graphs_OSM/"
-    folder_graph = "./data/processed/city_partners_public/graphs_SB/"
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--force", action="store_true", help="Ignore the cache and run all cities."
+    )
+    parser.add_argument(
+        "--profile-step",
+        default=None,
+        help="Name of a step to profile with cProfile for every city, see profiling.py.",
+    )
+    args = parser.parse_args()
+    folder_graph_names = FOLDER_CITY_PARTNERS + "graphs_OSM/"
     for file_graph in tqdm.tqdm(
         sorted(
             [
@@ -23,15 +74,6 @@ if __name__ == "__main__":
     ):
         city_name = file_graph.split(".")[0]
         for part_name in ["residential", "betweenness"]:
-            df = gpd.read_file(
-                folder_graph + f"{city_name}/{city_name}_{part_name}.gpkg",
-                layer="ltns",
-            )
-            df_filt = df[
-                (df["geometry"].area < 921600)
-                & (df["geometry"].area > 25600)
-                & (df["n"] > 5)
-            ]
-            df_filt.to_file(
-                folder_graph + f"{city_name}/{city_name}_{part_name}_filt_ltns.gpkg"
+            filter_ltns(
+                city_name, part_name, force=args.force, profile_step=args.profile_step
             )
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Merge the LTNs of all cities and partitioners into a single GeoPackage in EPSG:4326.
+Rows are sorted and indexed by city and partitioner, for queries such as read_gpkg(file, where="city = 'Riga'").
+"""
+
+import argparse
+import os
+import pandas as pd
+import tqdm
+from cache import stage_key, load_cached, save_cached
+from gpkg_io import read_gpkg, write_gpkg, create_index
+from profiling import StepManifest
+from utils import FOLDER_CITY_PARTNERS, LTN_FILTER, is_ltn
+
+
+PART_NAMES = ["betweenness", "residential"]
+
+
+def city_ltns(city_name, part_name, ltn_filter=LTN_FILTER, folder=FOLDER_CITY_PARTNERS):
+    "Get the LTNs of city_name for part_name, with the columns city, partitioner and filtered."
+    folder_graph = folder + "graphs_SB/"
+    gdf = read_gpkg(folder_graph + f"{city_name}/{city_name}_{part_name}.gpkg", "ltns")
+    gdf = gdf.to_crs("EPSG:4326")
+    gdf.insert(0, "city", city_name)
+    gdf.insert(1, "partitioner", part_name)
+    gdf.insert(2, "filtered", is_ltn(gdf["area"], gdf["n"], *ltn_filter))
+    return gdf
+
+
+def save_catalogue(
+    city_names,
+    part_names=PART_NAMES,
+    force=False,
+    profile_step=None,
+    ltn_filter=LTN_FILTER,
+    folder=FOLDER_CITY_PARTNERS,
+):
+    "Save in folder the catalogue of the LTNs of city_names, unless it is cached."
+    folder_graph = folder + "graphs_SB/"
+    folder_cache = folder + "cache/06_ltn_catalogue/"
+    file_catalogue = folder + "ltn_catalogue.gpkg"
+    key = stage_key(
+        "ltn_catalogue",
+        [
+            folder_graph + f"{city_name}/{city_name}_{part_name}.gpkg"
+            for city_name in city_names
+            for part_name in part_names
+        ],
+        {"ltn_filter": list(ltn_filter)},
+    )
+    if not force and load_cached(folder_cache, "ltn_catalogue", key) is not None:
+        return
+    manifest = StepManifest(
+        folder + "manifest.jsonl",
+        "06_ltn_catalogue",
+        "all",
+        profile_step,
+    )
+    with manifest.step("read_ltns"):
+        gdf = pd.concat(
+            [
+                city_ltns(city_name, part_name, ltn_filter, folder)
+                for city_name in tqdm.tqdm(city_names)
+                for part_name in part_names
+            ],
+            ignore_index=True,
+        )
+    with manifest.step("write_catalogue"):
+        # Neighbouring LTNs of a city end up in the same pages of the file
+        gdf["position"] = gdf.geometry.hilbert_distance()
+        gdf = gdf.sort_values(["city", "partitioner", "position"], kind="stable")
+        if os.path.exists(file_catalogue):
+            os.remove(file_catalogue)
+        write_gpkg(gdf.drop(columns="position"), file_catalogue, layer="ltns")
+        create_index(file_catalogue, "ltns", ["city", "partitioner"])
+    save_cached(folder_cache, "ltn_catalogue", key, [file_catalogue])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--force", action="store_true", help="Ignore the cache and merge again."
+    )
+    parser.add_argument(
+        "--profile-step",
+        default=None,
+        help="Name of a step to profile with cProfile, see profiling.py.",
+    )
+    args = parser.parse_args()
+    folder_graph_names = FOLDER_CITY_PARTNERS + "graphs_OSM/"
+    city_names = sorted(
+        [
+            filename.split(".")[0]
+            for filename in os.listdir(folder_graph_names)
+            if filename.endswith(".graphml")
+        ]
+    )
+    save_catalogue(city_names, force=args.force, profile_step=args.profile_step)
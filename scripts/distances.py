@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Distance matrices used for the relative travel metrics.
+In float32 mode, distances are rounded to float32 and the ratio dgr / dg has a relative error below 3e-7.
+This is far below the rounding of the results, but the maximal detour can come from another pair of equal ratio.
+"""
+
+import os
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from cache import atomic_write, file_lock, graph_hash
+
+
+def avoid_zerodiv_matrix(num_mat, den_mat):
+    """
+    Divide one matrix by another while replacing numerator divided by 0 by 0.
+    Example: [[1, 2],   divided by [[1, 0],    will give out [[1, 0],
+              [3, 4]]               [6, 0]]                   [0.5, 0]]
+    """
+    return np.divide(
+        num_mat,
+        den_mat,
+        out=np.zeros_like(num_mat),
+        where=((den_mat != 0) & (den_mat != np.inf) & (num_mat != np.inf)),
+    )
+
+
+def relative_travel_stats(dgr, dg, block_size=1024):
+    "Get the average relative travel and maximal detour of dgr over dg, read by blocks of rows."
+    rel_sum = 0.0
+    rel_count = 0
+    rel_max = -np.inf
+    argmax = (0, 0)
+    for start in range(0, dg.shape[0], block_size):
+        rel_travel = avoid_zerodiv_matrix(
+            np.asarray(dgr[start : start + block_size]),
+            np.asarray(dg[start : start + block_size]),
+        )
+        rel_sum += np.sum(rel_travel, dtype=np.float64)
+        rel_count += np.count_nonzero(rel_travel)
+        idx = np.argmax(rel_travel)
+        # Strictly greater to keep the first maximum, as np.where does
+        if rel_travel.flat[idx] > rel_max:
+            rel_max = rel_travel.flat[idx]
+            argmax = (start + idx // dg.shape[1], idx % dg.shape[1])
+    return np.float64(rel_sum) / rel_count, dgr[argmax] - dg[argmax]
+
+
+def _dijkstra_blocks(graphs, indices=None, dtype=np.float32, block_size=1024):
+    "Get the minimal distances over graphs from indices to all nodes, by blocks of sources."
+    n = graphs[0].shape[0]
+    if indices is None:
+        indices = np.arange(n)
+    dist = np.empty((len(indices), n), dtype=dtype)
+    for start in range(0, len(indices), block_size):
+        block_indices = indices[start : start + block_size]
+        block = dijkstra(graphs[0], directed=True, indices=block_indices)
+        for graph_matrix in graphs[1:]:
+            np.minimum(
+                block,
+                dijkstra(graph_matrix, directed=True, indices=block_indices),
+                out=block,
+            )
+        dist[start : start + block_size] = block
+    return dist
+
+
+def path_distance_matrix(G, weight, folder_cache, block_size=1024):
+    """
+    Get the float32 distance matrix of G, cached in folder_cache and memory-mapped read-only.
+    Concurrent workers compute it once under a lock and share a single copy.
+    """
+    os.makedirs(folder_cache, exist_ok=True)
+    path = os.path.join(folder_cache, f"{graph_hash(G, weight)}_{weight}.npy")
+    if not os.path.exists(path):
+        # A single worker computes the matrix, the others wait for it
+        with file_lock(path):
+            if not os.path.exists(path):
+                graph_matrix = nx.to_scipy_sparse_array(G, weight=weight, format="csr")
+                dg = _dijkstra_blocks([graph_matrix], block_size=block_size)
+                with atomic_write(path) as path_tmp, open(path_tmp, "wb") as f:
+                    np.save(f, dg)
+                del dg
+    return np.load(path, mmap_mode="r")
+
+
+def restricted_distance_matrix(
+    G, partitions, weight, node_order, dtype=np.float32, block_size=1024, sources=None
+):
+    """
+    Get the distances of superblockify shortest_paths_restricted, without the predecessors.
+    With float32 they are computed by blocks of rows, only for sources if given.
+    """
+    n = len(node_order)
+    index = {node: i for i, node in enumerate(node_order)}
+    n_sparse_indices = [index[node] for node in partitions["sparsified"]["nodes"]]
+    part_name_order = [name for name in partitions if name != "sparsified"]
+    n_partition_indices_separate = [
+        [index[node] for node in partitions[name]["nodes"]] for name in part_name_order
+    ]
+    n_partition_indices = [i for part in n_partition_indices_separate for i in part]
+    # Semipermeable graphs, one where partitions can only be left and one where they can only be entered
+    g_coo = nx.to_scipy_sparse_array(
+        G, nodelist=node_order, weight=weight, format="coo"
+    )
+    data, row, col = g_coo.data, g_coo.row, g_coo.col
+    row_sparse, col_sparse = (
+        np.isin(row, n_sparse_indices),
+        np.isin(col, n_sparse_indices),
+    )
+    mask_intra = row_sparse & col_sparse
+    for n_ind in n_partition_indices_separate:
+        mask_intra |= np.isin(row, n_ind) & np.isin(col, n_ind)
+    mask_to = (row_sparse & np.isin(col, n_partition_indices)) | mask_intra
+    mask_from = (np.isin(row, n_partition_indices) & col_sparse) | mask_intra
+    g_leaving = csr_matrix((data[mask_to], (row[mask_to], col[mask_to])), shape=(n, n))
+    g_entering = csr_matrix(
+        (data[mask_from], (row[mask_from], col[mask_from])), shape=(n, n)
+    )
+    # Rows needed: the sources and the nodes shared between the sparsified graph and the partitions of the sources
+    sparse_nodelist = set(partitions["sparsified"]["nodelist"])
+    source_set = set(range(n)) if sources is None else set(sources)
+    fill_up = []
+    for part_idx, name in zip(n_partition_indices_separate, part_name_order):
+        part_sources = [i for i in part_idx if i in source_set]
+        part_intersect = [
+            index[node]
+            for node in sparse_nodelist.intersection(partitions[name]["nodelist"])
+        ]
+        if part_sources and part_intersect:
+            fill_up.append((part_sources, part_intersect))
+    if sources is None:
+        rows = np.arange(n)
+    else:
+        rows = np.array(
+            sorted(source_set.union(*[inter for _, inter in fill_up])), dtype=int
+        )
+    row_pos = np.full(n, -1)
+    row_pos[rows] = np.arange(len(rows))
+    dist = _dijkstra_blocks(
+        [g_leaving, g_entering], indices=rows, dtype=dtype, block_size=block_size
+    )
+    # Fill up paths between partitions going through the nodes they share with the sparsified graph
+    # As in superblockify, paths are rounded to float32 before being compared
+    n_partition_indices = np.asarray(n_partition_indices)
+    for part_sources, part_intersect in fill_up:
+        dist_to = dist[np.ix_(row_pos[part_sources], part_intersect)]
+        dist_via = dist[np.ix_(row_pos[part_intersect], n_partition_indices)]
+        for i, dist_i in zip(row_pos[part_sources], dist_to):
+            dist_step = np.min(dist_i[:, np.newaxis] + dist_via, axis=0).astype(
+                np.float32
+            )
+            mask = dist_step < dist[i, n_partition_indices]
+            dist[i, n_partition_indices[mask]] = dist_step[mask]
+    if sources is None:
+        return dist
+    return dist[row_pos[sources]]
+
+
+def sampled_relative_travel(
+    G,
+    partitions,
+    weight,
+    n_origins,
+    population_weighted=False,
+    n_boot=1000,
+    confidence=0.95,
+    seed=0,
+):
+    """
+    Estimate the results of relative_travel_stats from n_origins random origins, with bootstrap intervals.
+    If population_weighted, origins are drawn with replacement proportionally to their population.
+    The sampled maximal detour is a lower bound of the exact one.
+    """
+    rng = np.random.default_rng(seed)
+    node_order = list(G.nodes)
+    index = {node: i for i, node in enumerate(node_order)}
+    prob = None
+    if population_weighted:
+        prob = np.zeros(len(node_order))
+        for u, v, pop in G.edges(data="population", default=0):
+            prob[index[u]] += pop / 2
+            prob[index[v]] += pop / 2
+        prob /= prob.sum()
+        sources, counts = np.unique(
+            rng.choice(len(node_order), size=n_origins, replace=True, p=prob),
+            return_counts=True,
+        )
+    else:
+        n_origins = min(n_origins, len(node_order))
+        sources = np.sort(rng.choice(len(node_order), size=n_origins, replace=False))
+        counts = np.ones(n_origins, dtype=int)
+    graph_matrix = nx.to_scipy_sparse_array(G, weight=weight, format="csr")
+    dg = _dijkstra_blocks([graph_matrix], indices=sources, dtype=np.float64)
+    dgr = restricted_distance_matrix(
+        G, partitions, weight, node_order, dtype=np.float64, sources=sources
+    )
+    rel_travel = avoid_zerodiv_matrix(dgr, dg)
+    # Statistics of each origin, to resample in the bootstrap
+    rel_sum = np.sum(rel_travel, axis=1)
+    rel_count = np.count_nonzero(rel_travel, axis=1)
+    argmax = np.argmax(rel_travel, axis=1)
+    rel_max = rel_travel[np.arange(len(sources)), argmax]
+    detour = (dgr - dg)[np.arange(len(sources)), argmax]
+    # Resample the draws, an origin drawn several times being several draws
+    draws = np.repeat(np.arange(len(sources)), counts)
+    boot = draws[rng.integers(0, n_origins, size=(n_boot, n_origins))]
+    boot_avg = rel_sum[boot].sum(axis=1) / rel_count[boot].sum(axis=1)
+    boot_detour = detour[boot[np.arange(n_boot), np.argmax(rel_max[boot], axis=1)]]
+    quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+    return {
+        "avg_rel_travel": np.sum(counts * rel_sum) / np.sum(counts * rel_count),
+        "avg_rel_travel_ci": np.quantile(boot_avg, quantiles).tolist(),
+        "max_detour": detour[np.argmax(rel_max)],
+        "max_detour_ci": np.quantile(boot_detour, quantiles).tolist(),
+        "n_origins": n_origins,
+    }
+
+
+def restricted_partitions(G, partition_nodes, labels, names=None):
+    "Get the partitions of the restricted distances, with only the LTNs of labels in names if given."
+    if names is not None:
+        names = set(names)
+    partitions = {
+        partition["name"]: {
+            "subgraph": partition["subgraph"],
+            "nodes": list(partition["nodes"]),  # exclusive nodes inside the subgraph
+            "nodelist": list(partition["subgraph"]),  # also nodes shared with the
+            # sparsified graph or on partition boundaries
+        }
+        for partition in partition_nodes
+        if names is None or partition["name"] in names
+    }
+    sparsified = G.edge_subgraph(labels.index[~labels["in_ltn"]].tolist())
+    partitions["sparsified"] = {
+        "subgraph": sparsified,
+        "nodes": list(sparsified.nodes),
+        "nodelist": list(sparsified.nodes),
+    }
+    return partitions
+
+
+def relative_travel(
+    G, partitions, dg, float32=False, sample=None, population_weighted=False, seed=0
+):
+    """
+    Get the graph attributes of the relative travel of G restricted by partitions.
+    They are estimated from sample origins if given, see sampled_relative_travel.
+    """
+    if sample is not None:
+        return sampled_relative_travel(
+            G,
+            partitions,
+            "length",
+            sample,
+            population_weighted=population_weighted,
+            seed=seed,
+        )
+    dgr = restricted_distance_matrix(
+        G,
+        partitions,
+        "length",
+        list(G.nodes),
+        dtype=np.float32 if float32 else np.float64,
+    )
+    avg_rel_travel, max_detour = relative_travel_stats(dgr, dg)
+    return {"avg_rel_travel": avg_rel_travel, "max_detour": max_detour}
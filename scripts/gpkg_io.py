@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Read and write GeoPackages through Arrow with pyogrio.
+"""
+
+import json
+import os
+import osmnx as ox
+import pyogrio
+import sqlite3
+
+
+def read_gpkg(filepath, layer=None, columns=None, where=None, bbox=None):
+    """
+    Read layer of the GeoPackage at filepath, with only columns and the rows matching where and bbox.
+    In where, {geometry} stands for the geometry column, such as "ST_Area({geometry}) > 1000".
+    """
+    if layer is None:
+        layer = pyogrio.list_layers(filepath)[0][0]
+    geometry_name = pyogrio.read_info(filepath, layer=layer)["geometry_name"]
+    geometry = '"' + geometry_name + '"'
+    select = (
+        "*" if columns is None else ", ".join([*map(json.dumps, columns), geometry])
+    )
+    sql = f'SELECT {select} FROM "{layer}"'
+    conditions = [] if where is None else ["(" + where.format(geometry=geometry) + ")"]
+    if bbox is not None:
+        xmin, ymin, xmax, ymax = bbox
+        conditions.append(
+            f'rowid IN (SELECT id FROM "rtree_{layer}_{geometry_name}" '
+            + f"WHERE maxx >= {xmin} AND minx <= {xmax} "
+            + f"AND maxy >= {ymin} AND miny <= {ymax})"
+        )
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return pyogrio.read_dataframe(filepath, sql=sql, use_arrow=True)
+
+
+def create_index(filepath, layer, columns):
+    "Create an SQLite index on columns of layer, for reads filtered on them."
+    with sqlite3.connect(filepath) as con:
+        con.execute(
+            f'CREATE INDEX IF NOT EXISTS "idx_{layer}_{"_".join(columns)}" '
+            + f'ON "{layer}" ({", ".join(map(json.dumps, columns))})'
+        )
+    con.close()
+
+
+def _typed_columns(gdf):
+    "Get a copy of gdf with the columns of lists or mixed types as JSON strings."
+    gdf = gdf.copy()
+    for col in gdf.columns:
+        if col == gdf.geometry.name or gdf[col].dtype != object:
+            continue
+        types = {type(v) for v in gdf[col] if v is not None}
+        if len(types) > 1 or types & {list, tuple, dict, set}:
+            gdf[col] = [
+                None if v is None else json.dumps(list(v) if isinstance(v, set) else v)
+                for v in gdf[col]
+            ]
+    return gdf
+
+
+def write_gpkg(gdf, filepath, layer=None):
+    "Write gdf as layer of the GeoPackage at filepath, replacing it."
+    pyogrio.write_dataframe(
+        _typed_columns(gdf), filepath, layer=layer, driver="GPKG", use_arrow=True
+    )
+
+
+def save_graph_gpkg(G, filepath):
+    "Save the nodes and edges of G as the layers of a new GeoPackage at filepath, for GIS software."
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    gdf_nodes, gdf_edges = ox.graph_to_gdfs(G)
+    write_gpkg(gdf_nodes.reset_index(), filepath, layer="nodes")
+    write_gpkg(gdf_edges.reset_index(), filepath, layer="edges")
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Save and load graphs as Parquet tables, faster than GraphML and keeping the dtypes of the attributes.
+"""
+
+import json
+import networkx as nx
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyproj
+import shapely
+
+
+def graph_parquet_paths(filepath):
+    "Get the paths of the node and edge tables of the graph saved at filepath."
+    return [filepath + "_nodes.parquet", filepath + "_edges.parquet"]
+
+
+def _encode(value):
+    "Make a graph attribute JSON serializable."
+    if isinstance(value, shapely.Geometry):
+        return {"__wkb__": shapely.to_wkb(value, hex=True)}
+    if isinstance(value, pyproj.CRS):
+        return {"__crs__": value.to_wkt()}
+    if isinstance(value, dict):
+        return {"__dict__": [[_encode(k), _encode(v)] for k, v in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _decode(value):
+    "Inverse of _encode."
+    if isinstance(value, dict):
+        if "__wkb__" in value:
+            return shapely.from_wkb(value["__wkb__"])
+        if "__crs__" in value:
+            return pyproj.CRS.from_wkt(value["__crs__"])
+        return {_decode(k): _decode(v) for k, v in value["__dict__"]}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _to_table(columns, crs=None):
+    """
+    Make a pyarrow table from columns of attribute values, None being saved as null.
+    Geometries are saved as WKB and columns of mixed types as JSON strings.
+    """
+    arrays = {}
+    geometry_columns = []
+    json_columns = []
+    for name, values in columns.items():
+        non_null = [v for v in values if v is not None]
+        if non_null and all(isinstance(v, shapely.Geometry) for v in non_null):
+            arrays[name] = pa.array(
+                shapely.to_wkb(np.array(values, dtype=object)), type=pa.binary()
+            )
+            geometry_columns.append(name)
+            continue
+        try:
+            arrays[name] = pa.array(values, from_pandas=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays[name] = pa.array(
+                [None if v is None else json.dumps(v) for v in values],
+                type=pa.string(),
+            )
+            json_columns.append(name)
+    table = pa.table(arrays)
+    metadata = {
+        "graph_io": json.dumps(
+            {"geometry_columns": geometry_columns, "json_columns": json_columns}
+        )
+    }
+    if geometry_columns:
+        crs_json = None if crs is None else pyproj.CRS(crs).to_json_dict()
+        metadata["geo"] = json.dumps(
+            {
+                "version": "1.0.0",
+                "primary_column": geometry_columns[0],
+                "columns": {
+                    name: {"encoding": "WKB", "geometry_types": [], "crs": crs_json}
+                    for name in geometry_columns
+                },
+            }
+        )
+    return table.replace_schema_metadata(metadata)
+
+
+def _from_table(table):
+    "Get the dictionary of columns of attribute values from a table made by _to_table."
+    meta = json.loads(table.schema.metadata[b"graph_io"])
+    columns = {}
+    for name in table.column_names:
+        if name in meta["geometry_columns"]:
+            columns[name] = list(
+                shapely.from_wkb(table[name].to_numpy(zero_copy_only=False))
+            )
+        elif name in meta["json_columns"]:
+            columns[name] = [
+                None if v is None else json.loads(v) for v in table[name].to_pylist()
+            ]
+        else:
+            columns[name] = table[name].to_pylist()
+    return columns
+
+
+def _attribute_columns(data):
+    "Get a dictionary of columns from the attribute dictionaries in data, with None for missing values."
+    names = list(dict.fromkeys(attr for d in data for attr in d))
+    return {name: [d.get(name) for d in data] for name in names}
+
+
+def _attribute_dicts(columns, length):
+    "Inverse of _attribute_columns, dropping missing values."
+    names = list(columns)
+    rows = zip(*columns.values()) if columns else [()] * length
+    return [{name: x for name, x in zip(names, row) if x is not None} for row in rows]
+
+
+def save_graph_parquet(G, filepath):
+    "Save G as Parquet tables of nodes and edges, see graph_parquet_paths."
+    path_nodes, path_edges = graph_parquet_paths(filepath)
+    columns = {
+        "node": list(G.nodes),
+        **_attribute_columns([d for _, d in G.nodes(data=True)]),
+    }
+    pq.write_table(_to_table(columns, crs=G.graph.get("crs")), path_nodes)
+    edge_list = list(G.edges(keys=True, data=True))
+    columns = {
+        "u": [u for u, _, _, _ in edge_list],
+        "v": [v for _, v, _, _ in edge_list],
+        "key": [k for _, _, k, _ in edge_list],
+        **_attribute_columns([d for _, _, _, d in edge_list]),
+    }
+    table = _to_table(columns, crs=G.graph.get("crs"))
+    metadata = table.schema.metadata
+    metadata[b"graph"] = json.dumps(_encode(G.graph))
+    pq.write_table(table.replace_schema_metadata(metadata), path_edges)
+
+
+def load_graph_parquet(filepath):
+    "Load a networkx MultiDiGraph saved with save_graph_parquet."
+    path_nodes, path_edges = graph_parquet_paths(filepath)
+    table_edges = pq.read_table(path_edges)
+    G = nx.MultiDiGraph(**_decode(json.loads(table_edges.schema.metadata[b"graph"])))
+    columns = _from_table(pq.read_table(path_nodes))
+    nodes = columns.pop("node")
+    G.add_nodes_from(zip(nodes, _attribute_dicts(columns, len(nodes))))
+    columns = _from_table(table_edges)
+    u, v, k = columns.pop("u"), columns.pop("v"), columns.pop("key")
+    G.add_edges_from(zip(u, v, k, _attribute_dicts(columns, len(u))))
+    return G
+
+
+def load_graph_attributes(filepath):
+    "Load only the graph attributes of the graph saved at filepath."
+    schema = pq.read_schema(graph_parquet_paths(filepath)[1])
+    return _decode(json.loads(schema.metadata[b"graph"]))
+
+
+def load_edge_columns(filepath, columns):
+    "Load only the edge columns of the graph saved at filepath, as NumPy arrays."
+    table = pq.read_table(graph_parquet_paths(filepath)[1], columns=columns)
+    json_columns = json.loads(table.schema.metadata[b"graph_io"])["json_columns"]
+    arrays = {}
+    for name in columns:
+        if name not in json_columns:
+            arrays[name] = table[name].to_numpy()
+            continue
+        # Filled one by one so that lists of the same length stay objects
+        arrays[name] = np.empty(len(table), dtype=object)
+        for i, v in enumerate(table[name].to_pylist()):
+            arrays[name][i] = None if v is None else json.loads(v)
+    return arrays
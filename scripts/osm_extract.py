@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Build the street graphs of many polygons from a single local OpenStreetMap extract.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import shapely
+from osmnx import _overpass
+
+
+def network_filter(network_type="drive"):
+    "Get the conditions (key, pattern) of the Overpass filter of OSMnx for network_type."
+    osm_filter = _overpass._get_network_filter(network_type)
+    conditions = re.findall(r'\["([^"]+)"(?:!~"([^"]*)")?\]', osm_filter)
+    rebuilt = "".join(
+        f'["{key}"!~"{pattern}"]' if pattern else f'["{key}"]'
+        for key, pattern in conditions
+    )
+    if rebuilt != osm_filter:
+        raise ValueError(f"Unsupported filter for {network_type}: {osm_filter}")
+    return [(key, pattern or None) for key, pattern in conditions]
+
+
+def _keep_way(tags, conditions):
+    "Get whether a way with tags passes all conditions of network_filter, as Overpass would."
+    for key, pattern in conditions:
+        value = tags.get(key)
+        if pattern is None:
+            if value is None:
+                return False
+        elif value is not None and re.search(pattern, str(value)):
+            return False
+    return True
+
+
+def _xml_path(filepath, folder_tmp):
+    "Get the path of filepath as OSM XML, converting .osm.pbf files with osmium."
+    if not filepath.endswith(".pbf"):
+        return filepath
+    if shutil.which("osmium") is None:
+        raise ValueError(
+            "Reading .osm.pbf extracts needs the osmium command-line tool, "
+            + "or convert them beforehand with: osmium cat extract.osm.pbf -o extract.osm"
+        )
+    path = os.path.join(folder_tmp, "extract.osm")
+    subprocess.run(["osmium", "cat", filepath, "-o", path], check=True)
+    return path
+
+
+def graphs_from_extract(filepath, polygons, network_type="drive"):
+    """
+    Get the graphs of network_type within each of polygons, in lon/lat, from the extract at filepath.
+    They match osmnx.graph_from_polygon with simplify=False, and the extract is parsed once.
+    """
+    conditions = network_filter(network_type)
+    # The tags of the filter must be kept on the edges to be tested, then dropped
+    useful_tags_way = ox.settings.useful_tags_way
+    extra_tags = [key for key, _ in conditions if key not in useful_tags_way]
+    ox.settings.useful_tags_way = list(dict.fromkeys([*useful_tags_way, *extra_tags]))
+    try:
+        with tempfile.TemporaryDirectory() as folder_tmp:
+            G = ox.graph_from_xml(
+                _xml_path(filepath, folder_tmp), simplify=False, retain_all=True
+            )
+    finally:
+        ox.settings.useful_tags_way = useful_tags_way
+    G.remove_edges_from(
+        [
+            (u, v, k)
+            for u, v, k, d in G.edges(keys=True, data=True)
+            if not _keep_way(d, conditions)
+        ]
+    )
+    for _, _, d in G.edges(data=True):
+        for key in extra_tags:
+            d.pop(key, None)
+    G.remove_nodes_from(list(nx.isolates(G)))
+    # Streets of the whole extract, as osmnx.graph_from_polygon counts them
+    street_count = ox.stats.count_streets_per_node(G)
+    nodes = np.array(G.nodes, dtype=object)
+    x = np.array([G.nodes[n]["x"] for n in nodes])
+    y = np.array([G.nodes[n]["y"] for n in nodes])
+    graphs = {}
+    for name, polygon in polygons.items():
+        shapely.prepare(polygon)
+        inside = shapely.intersects_xy(polygon, x, y)
+        graphs[name] = ox.truncate.largest_component(
+            G.subgraph(nodes[inside].tolist()).copy()
+        )
+        nx.set_node_attributes(
+            graphs[name],
+            {node: street_count[node] for node in graphs[name].nodes},
+            "street_count",
+        )
+    return graphs
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Run jobs in separate worker processes, so that the failure of one job does not stop the others.
+"""
+
+import multiprocessing as mp
+import os
+import resource
+import time
+import traceback
+from multiprocessing.connection import wait
+import tqdm
+
+# The TBB threading layer of numba hangs the parent at exit once it has forked, set it before numba is imported
+os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+
+
+def _run_job(func, args, conn, max_memory):
+    "Run func(*args) in the worker process and send back None or the traceback."
+    if max_memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+    try:
+        func(*args)
+        conn.send(None)
+    except BaseException:
+        conn.send(traceback.format_exc())
+    finally:
+        conn.close()
+
+
+def _receive(job):
+    "Read the message sent by the worker of job, if any."
+    try:
+        job["error"] = job["conn"].recv()
+        job["done"] = True
+    except EOFError:
+        pass
+
+
+def run_jobs(func, jobs, workers=None, timeout=None, max_memory=None):
+    """
+    Run func(*args) for every args of jobs in at most workers processes, with a timeout and max_memory.
+    Return the failed jobs with the reason of their failure.
+    """
+    return run_dag(
+        {args: (func, args, ()) for args in jobs},
+        workers=workers,
+        timeout=timeout,
+        max_memory=max_memory,
+    )
+
+
+def run_dag(tasks, workers=None, timeout=None, max_memory=None):
+    """
+    Run the tasks {name: (func, args, deps)} as run_jobs, each one once the tasks of deps succeeded.
+    Return the failed tasks, including the ones whose dependencies failed.
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    for name, (_, _, deps) in tasks.items():
+        unknown = [dep for dep in deps if dep not in tasks]
+        if unknown:
+            raise ValueError(f"Task {name} depends on unknown tasks {unknown}.")
+    waiting = dict(tasks)
+    succeeded = set()
+    running = {}
+    failed = {}
+    with tqdm.tqdm(total=len(tasks)) as pbar:
+        while waiting or running:
+            # Fail the tasks depending on failed tasks, until no more fail
+            n_failed = None
+            while n_failed != len(failed):
+                n_failed = len(failed)
+                for name, (_, _, deps) in list(waiting.items()):
+                    failed_deps = [dep for dep in deps if dep in failed]
+                    if failed_deps:
+                        del waiting[name]
+                        failed[name] = f"Not run, depends on failed tasks {failed_deps}"
+                        pbar.update()
+            for name, (func, args, deps) in list(waiting.items()):
+                if len(running) >= workers:
+                    break
+                if not all(dep in succeeded for dep in deps):
+                    continue
+                del waiting[name]
+                recv_conn, send_conn = mp.Pipe(duplex=False)
+                proc = mp.Process(
+                    target=_run_job, args=(func, args, send_conn, max_memory)
+                )
+                proc.start()
+                send_conn.close()
+                running[proc.sentinel] = {
+                    "proc": proc,
+                    "name": name,
+                    "conn": recv_conn,
+                    "start": time.monotonic(),
+                    "done": False,
+                    "error": None,
+                }
+            if not running:
+                if waiting:
+                    raise ValueError(f"Tasks {list(waiting)} have cyclic dependencies.")
+                break
+            # Read messages as they come so that no worker blocks on a full pipe
+            ready = wait(
+                list(running) + [job["conn"] for job in running.values()], timeout=1
+            )
+            for sentinel, job in list(running.items()):
+                if job["conn"] in ready:
+                    _receive(job)
+                if job["proc"].is_alive():
+                    if timeout is None or time.monotonic() - job["start"] < timeout:
+                        continue
+                    job["proc"].terminate()
+                    job["proc"].join()
+                    failed[job["name"]] = f"Timeout after {timeout} seconds"
+                else:
+                    job["proc"].join()
+                    if not job["done"] and job["conn"].poll():
+                        _receive(job)
+                    if job["error"] is not None:
+                        failed[job["name"]] = job["error"]
+                    elif not job["done"] or job["proc"].exitcode != 0:
+                        failed[
+                            job["name"]
+                        ] = f"Worker exited with code {job['proc'].exitcode}"
+                    else:
+                        succeeded.add(job["name"])
+                job["conn"].close()
+                del running[sentinel]
+                pbar.update()
+    return failed
+
+
+def print_failed_jobs(failed, n_jobs):
+    "Print a summary of the failed jobs returned by run_jobs."
+    print(f"{n_jobs - len(failed)}/{n_jobs} jobs succeeded.")
+    for args, reason in failed.items():
+        print(f"Failed job {args}:\n{reason}")
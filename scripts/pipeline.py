@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Run the stages of the city partners pipeline for a study declared in a YAML file, see "./scripts/studies/city_partners_public.yml".
+Each task of a stage starts in its own process as soon as the tasks it depends on are done.
+"""
+
+import argparse
+import os
+import yaml
+
+# Imported before the stages to set the threading layer of numba, see parallel.py
+from parallel import run_dag, print_failed_jobs
+from city_partners_00_create_graphs import create_graphs, plot_city
+from city_partners_01_prepare_graphs import prepare_graph
+from city_partners_02_get_metadata import city_metadata, save_metadata
+from city_partners_03_superblockify import PARTITIONERS, superblockify_city
+from city_partners_04_process import process_city, save_results
+from city_partners_05_dataviz_LTN_filt import filter_ltns
+from city_partners_06_ltn_catalogue import save_catalogue
+from utils import (
+    FOLDER_CITY_PARTNERS,
+    GHSL_DIR,
+    LTN_MIN_AREA,
+    LTN_MAX_AREA,
+    LTN_MIN_N,
+)
+
+
+STAGES = [
+    "extract",
+    "prepare",
+    "metadata",
+    "superblockify",
+    "process",
+    "filter",
+    "catalogue",
+]
+
+
+def load_study(filepath):
+    "Load the study of the YAML file at filepath, with the defaults of the scripts."
+    with open(filepath) as f:
+        study = yaml.safe_load(f) or {}
+    study.setdefault("polygons", "./data/raw/city_partners_public/")
+    study.setdefault("output", FOLDER_CITY_PARTNERS)
+    study.setdefault("ghsl_dir", GHSL_DIR)
+    study.setdefault("plots", "./plots/city_partners_public/graphs/")
+    for key in ["polygons", "output", "plots"]:
+        if study[key] is not None:
+            study[key] = os.path.join(study[key], "")
+    if study.get("cities") is None:
+        study["cities"] = sorted(
+            [
+                filename.split(".")[0]
+                for filename in os.listdir(study["polygons"])
+                if filename.endswith(".gpkg")
+            ]
+        )
+    study.setdefault("extract", None)
+    study.setdefault("partitioners", list(PARTITIONERS))
+    unknown = [part for part in study["partitioners"] if part not in PARTITIONERS]
+    if unknown:
+        raise ValueError(
+            f"Unknown partitioners {unknown}, expected some of {list(PARTITIONERS)}."
+        )
+    ltn_filter = {
+        "min_area": LTN_MIN_AREA,
+        "max_area": LTN_MAX_AREA,
+        "min_n": LTN_MIN_N,
+        **(study.get("ltn_filter") or {}),
+    }
+    study["ltn_filter"] = (
+        ltn_filter["min_area"],
+        ltn_filter["max_area"],
+        ltn_filter["min_n"],
+    )
+    study["superblockify"] = {
+        "float32": False,
+        "sample": None,
+        "population_weighted": False,
+        "seed": 0,
+        **(study.get("superblockify") or {}),
+    }
+    for key in ["workers", "timeout", "max_memory"]:
+        study.setdefault(key, None)
+    return study
+
+
+def study_tasks(study, only=None, from_stage=STAGES[0], force=False, profile_step=None):
+    """
+    Get the tasks of study for parallel.run_dag, named (stage, city) or (stage, city, partitioner).
+    Only the cities of only and the stages from from_stage on are run.
+    """
+    cities = study["cities"] if only is None else only
+    unknown = [city_name for city_name in cities if city_name not in study["cities"]]
+    if unknown:
+        raise ValueError(f"Cities {unknown} are not in the study.")
+    file_polys = {
+        city_name: study["polygons"] + city_name + ".gpkg"
+        for city_name in study["cities"]
+    }
+    parts = study["partitioners"]
+    options = study["superblockify"]
+    folder = study["output"]
+    tasks = {}
+    if study["extract"] is not None:
+        # A single read of the extract for all cities
+        tasks[("extract", "all")] = (
+            create_graphs,
+            (
+                {city_name: file_polys[city_name] for city_name in cities},
+                study["extract"],
+                force,
+                profile_step,
+                None,
+                folder,
+            ),
+            (),
+        )
+    for city_name in cities:
+        extract = ("extract", "all" if study["extract"] is not None else city_name)
+        if study["extract"] is None:
+            tasks[extract] = (
+                create_graphs,
+                (
+                    {city_name: file_polys[city_name]},
+                    None,
+                    force,
+                    profile_step,
+                    None,
+                    folder,
+                ),
+                (),
+            )
+        if study["plots"] is not None:
+            tasks[("extract", city_name, "plot")] = (
+                plot_city,
+                (city_name, study["plots"], folder),
+                (extract,),
+            )
+        tasks[("prepare", city_name)] = (
+            prepare_graph,
+            (
+                city_name,
+                file_polys[city_name],
+                force,
+                profile_step,
+                folder,
+                study["ghsl_dir"],
+            ),
+            (extract,),
+        )
+        tasks[("metadata", city_name)] = (
+            city_metadata,
+            (city_name, file_polys[city_name], force, profile_step, folder),
+            (("prepare", city_name),),
+        )
+        for part_name in parts:
+            tasks[("superblockify", city_name, part_name)] = (
+                superblockify_city,
+                (
+                    city_name,
+                    part_name,
+                    force,
+                    options["float32"],
+                    options["sample"],
+                    options["population_weighted"],
+                    options["seed"],
+                    profile_step,
+                    study["ltn_filter"],
+                    folder,
+                    study["ghsl_dir"],
+                ),
+                (("prepare", city_name),),
+            )
+            tasks[("filter", city_name, part_name)] = (
+                filter_ltns,
+                (
+                    city_name,
+                    part_name,
+                    force,
+                    profile_step,
+                    study["ltn_filter"],
+                    folder,
+                ),
+                (("superblockify", city_name, part_name),),
+            )
+        tasks[("process", city_name)] = (
+            process_city,
+            (city_name, force, profile_step, parts, folder),
+            tuple(("superblockify", city_name, part_name) for part_name in parts),
+        )
+    tasks[("metadata", "all")] = (
+        save_metadata,
+        (file_polys, folder),
+        tuple(("metadata", city_name) for city_name in cities),
+    )
+    tasks[("process", "all")] = (
+        save_results,
+        (study["cities"], parts, folder),
+        tuple(("process", city_name) for city_name in cities),
+    )
+    tasks[("catalogue", "all")] = (
+        save_catalogue,
+        (
+            study["cities"],
+            parts,
+            force,
+            profile_step,
+            study["ltn_filter"],
+            folder,
+        ),
+        tuple(
+            ("superblockify", city_name, part_name)
+            for city_name in cities
+            for part_name in parts
+        ),
+    )
+    # Drop the stages before from_stage along with the dependencies on them
+    stages = STAGES[STAGES.index(from_stage) :]
+    tasks = {name: task for name, task in tasks.items() if name[0] in stages}
+    return {
+        name: (func, args, tuple(dep for dep in deps if dep in tasks))
+        for name, (func, args, deps) in tasks.items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("study", help="Path of the YAML file of the study.")
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        default=None,
+        help="Run only these cities of the study.",
+    )
+    parser.add_argument(
+        "--from-stage",
+        choices=STAGES,
+        default=STAGES[0],
+        help="Run only this stage and the next ones, using the outputs of the previous ones as they are.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Ignore the cache of the stages that are run.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, default to the value of the study or to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--profile-step",
+        default=None,
+        help="Name of a step to profile with cProfile for every city, see profiling.py.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the tasks and their dependencies without running them.",
+    )
+    args = parser.parse_args()
+    study = load_study(args.study)
+    tasks = study_tasks(
+        study,
+        only=args.only,
+        from_stage=args.from_stage,
+        force=args.force,
+        profile_step=args.profile_step,
+    )
+    if args.dry_run:
+        for name, (func, _, deps) in tasks.items():
+            print(name, func.__name__, "after", list(deps))
+    else:
+        failed = run_dag(
+            tasks,
+            workers=args.workers if args.workers is not None else study["workers"],
+            timeout=study["timeout"],
+            max_memory=None
+            if study["max_memory"] is None
+            else int(study["max_memory"] * 1e9),
+        )
+        print_failed_jobs(failed, len(tasks))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Prepare graphs extracted via OSMnx for Superblockify, with a cache of the cells and population of their edges.
+The cache is shared by the pipelines, graphs being identified by the hash of their geometry and CRS.
+"""
+
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyproj
+import rasterio
+import shapely
+import networkx as nx
+import geopandas as gpd
+import osmnx as ox
+from superblockify.utils import extract_attributes
+from superblockify.graph_stats import basic_graph_stats
+from superblockify.population import add_edge_cells
+from superblockify.population.approximation import load_ghsl_as_polygons
+from superblockify.population.ghsl import get_ghsl
+from cache import atomic_write
+from profiling import untimed_step
+from utils import decode_cells
+
+
+FOLDER_PREPARED = "./data/processed/prepared_graphs/"
+# Coordinates are rounded to this number of decimals, cm in projected CRS, before hashing
+HASH_DECIMALS = 2
+
+
+def geometry_hashes(geometries):
+    "Get the SHA-256 hash of the WKB of each geometry, with coordinates rounded to HASH_DECIMALS."
+    rounded = shapely.transform(
+        np.asarray(geometries, dtype=object), lambda c: np.round(c, HASH_DECIMALS)
+    )
+    return [hashlib.sha256(wkb).hexdigest() for wkb in shapely.to_wkb(rounded)]
+
+
+def edge_hashes(G):
+    "Get the geometry hash of each edge of G in the order of G.edges."
+    geometries = [
+        d["geometry"]
+        if "geometry" in d
+        else shapely.LineString(
+            [[G.nodes[u]["x"], G.nodes[u]["y"]], [G.nodes[v]["x"], G.nodes[v]["y"]]]
+        )
+        for u, v, d in G.edges(data=True)
+    ]
+    return geometry_hashes(geometries)
+
+
+def crs_hash(crs):
+    "Get the SHA-256 hash of the WKT of crs."
+    return hashlib.sha256(pyproj.CRS(crs).to_wkt().encode()).hexdigest()
+
+
+def prepared_key(G, hashes):
+    "Get the hash of G from the hashes of its edges, its nodes and its CRS."
+    nodes = geometry_hashes(
+        shapely.points([[d["x"], d["y"]] for _, d in G.nodes(data=True)])
+    )
+    h = hashlib.sha256(crs_hash(G.graph["crs"]).encode())
+    for node in sorted(nodes):
+        h.update(node.encode())
+    for edge in sorted(hashes):
+        h.update(edge.encode())
+    return h.hexdigest()
+
+
+def prepared_folder(crs, folder_prepared=FOLDER_PREPARED):
+    "Get the folder of the prepared graphs in crs, as cells are only comparable within the same CRS."
+    return os.path.join(folder_prepared, crs_hash(crs))
+
+
+def load_prepared(G, hashes, key, folder_prepared=FOLDER_PREPARED):
+    """
+    Set in place the cells and population of the edges of G stored with key.
+    Return False if there is no such graph.
+    """
+    path = os.path.join(
+        prepared_folder(G.graph["crs"], folder_prepared), key + ".parquet"
+    )
+    if not os.path.exists(path):
+        return False
+    df = pq.read_table(path).to_pandas().drop_duplicates("edge").set_index("edge")
+    rows = df.loc[hashes]
+    edges = list(G.edges(keys=True))
+    cells = shapely.from_wkb(rows["cell"].to_numpy())
+    nx.set_edge_attributes(G, dict(zip(edges, cells)), "cell")
+    nx.set_edge_attributes(
+        G, dict(zip(edges, shapely.area(cells).tolist())), "cell_area"
+    )
+    nx.set_edge_attributes(G, dict(zip(edges, rows["cell_id"].tolist())), "cell_id")
+    for name in ["population", "area"]:
+        nx.set_edge_attributes(G, dict(zip(edges, rows[name].to_numpy())), name)
+    G.graph["edge_population"] = True
+    return True
+
+
+def save_prepared(G, hashes, key, folder_prepared=FOLDER_PREPARED):
+    "Store the cells and population of the edges of G with key."
+    folder = prepared_folder(G.graph["crs"], folder_prepared)
+    os.makedirs(folder, exist_ok=True)
+    data = [G.edges[e] for e in G.edges(keys=True)]
+    cells = np.array([d["cell"] for d in data], dtype=object)
+    table = pa.table(
+        {
+            "edge": hashes,
+            "cell": shapely.to_wkb(cells),
+            "cell_hash": geometry_hashes(cells),
+            "cell_id": np.array([d["cell_id"] for d in data], dtype=np.int64),
+            "population": np.array([d["population"] for d in data], dtype=np.float32),
+            "area": np.array([d["area"] for d in data], dtype=np.float32),
+        }
+    )
+    path = os.path.join(folder, key + ".parquet")
+    with atomic_write(path) as path_tmp:
+        pq.write_table(table, path_tmp)
+
+
+def stored_population(crs, folder_prepared=FOLDER_PREPARED):
+    "Get the population of all cells stored in crs, indexed by the hash of the cell."
+    folder = prepared_folder(crs, folder_prepared)
+    if not os.path.exists(folder):
+        return pd.DataFrame(columns=["population"])
+    tables = [
+        pq.read_table(
+            os.path.join(folder, filename), columns=["cell_hash", "population"]
+        ).to_pandas()
+        for filename in sorted(os.listdir(folder))
+        if filename.endswith(".parquet")
+    ]
+    if not tables:
+        return pd.DataFrame(columns=["population"])
+    return pd.concat(tables).drop_duplicates("cell_hash").set_index("cell_hash")
+
+
+def cells_population(cells):
+    "Get the population of each cell, in World Mollweide, from the GHSL data."
+    bbox_moll = shapely.union_all(cells).buffer(100).bounds
+    ghsl_file = get_ghsl(bbox_moll)
+    with rasterio.open(ghsl_file) as src:
+        load_window = src.window(*bbox_moll)
+    ghsl_polygons = load_ghsl_as_polygons(ghsl_file, window=load_window)
+    polygons = np.asarray(ghsl_polygons.geometry.values, dtype=object)
+    populations = ghsl_polygons["population"].to_numpy(dtype=np.float64)
+    i_cell, i_ghsl = shapely.STRtree(polygons).query(cells, predicate="intersects")
+    fractions = (
+        populations[i_ghsl]
+        * shapely.area(shapely.intersection(cells[i_cell], polygons[i_ghsl]))
+        / shapely.area(polygons[i_ghsl])
+    )
+    return np.bincount(i_cell, weights=fractions, minlength=len(cells))
+
+
+def add_cell_population(G, folder_prepared=FOLDER_PREPARED):
+    """
+    Add in place the population and area of the cell of each edge of G.
+    Only cells that are not stored yet are computed, return their number.
+    """
+    edges = list(G.edges(keys=True))
+    cell_ids = np.array([G.edges[e]["cell_id"] for e in edges])
+    _, first, inverse = np.unique(cell_ids, return_index=True, return_inverse=True)
+    cells = np.array([G.edges[edges[i]]["cell"] for i in first], dtype=object)
+    cells_moll = np.asarray(
+        gpd.GeoSeries(cells, crs=G.graph["crs"]).to_crs("World Mollweide").values,
+        dtype=object,
+    )
+    stored = stored_population(G.graph["crs"], folder_prepared)
+    population = (
+        pd.Series(geometry_hashes(cells))
+        .map(stored["population"])
+        .to_numpy(dtype=np.float64, copy=True)
+    )
+    missing = np.isnan(population)
+    if missing.any():
+        population[missing] = cells_population(cells_moll[missing])
+    population = population.astype(np.float32)
+    area = shapely.area(cells_moll).astype(np.float32)
+    for e, i in zip(edges, inverse):
+        G.edges[e]["population"] = population[i]
+        G.edges[e]["area"] = area[i]
+    G.graph["edge_population"] = True
+    return int(missing.sum())
+
+
+def make_graph_compatible(
+    G, poly=None, proj_crs=None, step=untimed_step, folder_prepared=FOLDER_PREPARED
+):
+    """
+    Get a graph extracted via OSMnx compatible with Superblockify BasePartitioner.
+    Cells and population are reused from the prepared graphs of folder_prepared.
+    """
+    with step("project_graph", G):
+        G = G.copy()
+        ox.add_edge_bearings(G)
+        G = ox.project_graph(G, to_crs=proj_crs)
+        G = ox.add_edge_speeds(G)
+        G = ox.add_edge_travel_times(G)
+        street_count = ox.stats.count_streets_per_node(G)
+        nx.set_node_attributes(G, values=street_count, name="street_count")
+        G = extract_attributes(
+            G,
+            edge_attributes={
+                "geometry",
+                "osmid",
+                "length",
+                "highway",
+                "speed_kph",
+                "travel_time",
+                "bearing",
+            },
+            node_attributes={"y", "x", "lat", "lon", "osmid", "street_count"},
+        )
+    with step("add_edge_cells", G):
+        hashes = edge_hashes(G)
+        key = prepared_key(G, hashes)
+        prepared = load_prepared(G, hashes, key, folder_prepared)
+        if not prepared:
+            add_edge_cells(G)
+            decode_cells(G)
+    with step("add_edge_population", G):
+        if not prepared:
+            add_cell_population(G, folder_prepared)
+            save_prepared(G, hashes, key, folder_prepared)
+    with step("basic_graph_stats", G):
+        if poly is None:
+            gdf_edges = ox.graph_to_gdfs(G, nodes=False, edges=True)
+            streetgeom = gdf_edges.geometry.unary_union
+            bb = streetgeom.bounds
+            poly = gpd.GeoDataFrame(
+                shapely.Polygon(
+                    [[bb[2], bb[1]], [bb[2], bb[3]], [bb[0], bb[3]], [bb[0], bb[1]]]
+                ),
+                crs=proj_crs,
+            )
+        G.graph["boundary_crs"] = poly.crs
+        G.graph["boundary"] = poly.geometry[0]
+        G.graph["area"] = G.graph["boundary"].area
+        G.graph.update(basic_graph_stats(G, area=G.graph["area"]))
+    return G
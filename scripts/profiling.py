@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Record the time, peak memory and graph size of each step of the pipelines in a manifest of JSON lines.
+Run as a script to print a summary of a manifest.
+"""
+
+import argparse
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import time
+import pandas as pd
+
+
+def _peak_rss():
+    "Get the peak resident memory of the process in bytes since the last _reset_peak_rss."
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kB on Linux, the peak since the start of the process
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _reset_peak_rss():
+    "Reset the peak resident memory of the process to the current one, only possible on Linux."
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def untimed_step(name, G=None):
+    "Stand-in for StepManifest.step that records nothing, for functions called outside of the pipelines."
+    yield {}
+
+
+class StepManifest:
+    "Manifest of the steps of a stage on a city, with a cProfile dump of the step profile_step."
+
+    def __init__(self, path, stage, city_name, profile_step=None):
+        self.path = path
+        self.stage = stage
+        self.city_name = city_name
+        self.profile_step = profile_step
+        self._running = []
+
+    @contextlib.contextmanager
+    def step(self, name, G=None):
+        """
+        Record the step name of the with block and the size of the graph G at its end.
+        The yielded dictionary can be given the graph when G is made in the block.
+        """
+        record = {"graph": G, "peak_rss": 0}
+        # Keep the peak of the outer step so far before resetting it
+        if self._running:
+            parent = self._running[-1]
+            parent["peak_rss"] = max(parent["peak_rss"], _peak_rss())
+        self._running.append(record)
+        profiler = cProfile.Profile() if name == self.profile_step else None
+        _reset_peak_rss()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        failed = True
+        try:
+            yield record
+            failed = False
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            peak_rss = max(_peak_rss(), record["peak_rss"])
+            self._running.pop()
+            if self._running:
+                parent = self._running[-1]
+                parent["peak_rss"] = max(parent["peak_rss"], peak_rss)
+            G = record["graph"]
+            self._write(
+                {
+                    "stage": self.stage,
+                    "city": self.city_name,
+                    "step": name,
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "wall_s": round(wall, 3),
+                    "cpu_s": round(cpu, 3),
+                    "peak_rss_mb": round(peak_rss / 1e6, 1),
+                    "nodes": None if G is None else G.number_of_nodes(),
+                    "edges": None if G is None else G.number_of_edges(),
+                    "failed": failed,
+                }
+            )
+            if profiler is not None:
+                folder_profile = os.path.join(os.path.dirname(self.path), "profiles")
+                os.makedirs(folder_profile, exist_ok=True)
+                profiler.dump_stats(
+                    os.path.join(
+                        folder_profile, f"{self.stage}_{self.city_name}_{name}.prof"
+                    )
+                )
+
+    def _write(self, row):
+        "Append row as a JSON line, in a single write so that lines of concurrent processes do not mix."
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(row) + "\n")
+
+
+def read_manifest(path):
+    "Get the steps recorded in the manifest at path as a DataFrame."
+    return pd.read_json(path, lines=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("manifest", help="Path of the manifest to summarize.")
+    parser.add_argument(
+        "--top", type=int, default=20, help="Number of slowest steps to print."
+    )
+    args = parser.parse_args()
+    df = read_manifest(args.manifest)
+    # Keep only the last run of each step
+    df = df.drop_duplicates(["stage", "city", "step"], keep="last")
+    print(
+        df.sort_values("wall_s", ascending=False)
+        .head(args.top)[
+            ["stage", "city", "step", "wall_s", "cpu_s", "peak_rss_mb", "nodes"]
+        ]
+        .to_string(index=False)
+    )
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Render overview plots of the graphs saved as Parquet tables, outside of the processes building them.
+"""
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+import shapely
+from matplotlib.collections import LineCollection
+from graph_io import load_graph_parquet
+
+
+def plot_graph_lines(
+    G,
+    filepath,
+    figsize=(32, 32),
+    bgcolor="white",
+    node_color="black",
+    edge_color="#285c52",
+    node_size=7.5,
+    edge_linewidth=1,
+    dpi=300,
+):
+    "Save in filepath the plot of G as osmnx.plot_graph does, drawing the edges as a single LineCollection."
+    lines = []
+    for u, v, d in G.edges(data=True):
+        if "geometry" in d:
+            lines.append(d["geometry"])
+        else:
+            lines.append(
+                shapely.LineString(
+                    [
+                        [G.nodes[u]["x"], G.nodes[u]["y"]],
+                        [G.nodes[v]["x"], G.nodes[v]["y"]],
+                    ]
+                )
+            )
+    coords, index = shapely.get_coordinates(lines, return_index=True)
+    segments = np.split(coords, np.flatnonzero(np.diff(index)) + 1)
+    x = np.array([x for _, x in G.nodes(data="x")])
+    y = np.array([y for _, y in G.nodes(data="y")])
+    fig, ax = plt.subplots(figsize=figsize, facecolor=bgcolor, frameon=False)
+    ax.set_facecolor(bgcolor)
+    ax.add_collection(
+        LineCollection(segments, colors=edge_color, linewidths=edge_linewidth, zorder=1)
+    )
+    ax.scatter(x, y, s=node_size, c=node_color, zorder=1)
+    # Pad 2% to not cut off peripheral nodes, as OSMnx
+    left, bottom = coords.min(axis=0)
+    right, top = coords.max(axis=0)
+    ax.set_xlim(left - 0.02 * (right - left), right + 0.02 * (right - left))
+    ax.set_ylim(bottom - 0.02 * (top - bottom), top + 0.02 * (top - bottom))
+    if G.graph.get("crs") is None or "4326" in str(G.graph["crs"]):
+        # Correct the distortion of lon/lat at the latitude of the graph
+        ax.set_aspect(1 / np.cos(np.deg2rad((bottom + top) / 2)))
+    else:
+        ax.set_aspect("equal")
+    ax.axis("off")
+    fig.savefig(filepath, dpi=dpi, bbox_inches="tight", facecolor=bgcolor)
+    plt.close(fig)
+
+
+def plot_graph_file(file_graph, file_plot):
+    "Save in file_plot the plot of the graph saved as Parquet tables at file_graph, see plot_graph_lines."
+    plot_graph_lines(load_graph_parquet(file_graph), file_plot)
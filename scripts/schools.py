@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+Run a schools study declared in a YAML file, see "./scripts/studies/schools_braga.yml".
+The city is partitioned with the residential partitioner and with buffers around the schools for each scenario.
+"""
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import shapely
+import networkx as nx
+import geopandas as gpd
+import osmnx as ox
+import yaml
+import superblockify as sb
+from superblockify.partitioning import ResidentialPartitioner, EdgeAttributePartitioner
+from prepared_graphs import make_graph_compatible
+from profiling import StepManifest
+from distances import (
+    path_distance_matrix,
+    relative_travel,
+    restricted_partitions,
+)
+from gpkg_io import read_gpkg, write_gpkg
+from graph_io import save_graph_parquet, load_edge_columns, load_graph_attributes
+from utils import (
+    GHSL_DIR,
+    count_within,
+    add_edge_distances,
+    decode_cells,
+    is_ltn,
+    is_ltn_sql,
+    ltn_labels,
+    ltn_overlay,
+    remove_dead_ends,
+    removed_length_within,
+    set_ltn_labels,
+    tag_edges_in_buffer,
+    tag_edges_within,
+)
+
+
+def load_schools_study(filepath):
+    "Load the schools study of the YAML file at filepath, with the defaults for the missing keys."
+    with open(filepath) as f:
+        study = yaml.safe_load(f) or {}
+    for key in ["city", "polygon", "output", "schools", "scenarios"]:
+        if study.get(key) is None:
+            raise ValueError(f"Missing key {key} in the schools study {filepath}.")
+    study["output"] = os.path.join(study["output"], "")
+    study.setdefault("ghsl_dir", GHSL_DIR)
+    study.setdefault("polygon_buffer", 50)
+    study.setdefault("utm", False)
+    study["schools"] = {
+        "filter": None,
+        "within_polygon": False,
+        **study["schools"],
+    }
+    study.setdefault("metadata_distances", None)
+    scenarios = []
+    for scenario in study["scenarios"]:
+        if ("distance" in scenario) == ("zones" in scenario):
+            raise ValueError(
+                f"Scenario {scenario} needs either a distance or a file of zones."
+            )
+        if "distance" in scenario:
+            defaults = {
+                "name": f"buffer_{scenario['distance']}",
+                "suffix": f"_{scenario['distance']}",
+                "label": f"school buffer of {scenario['distance']}m",
+            }
+        else:
+            defaults = {"name": "buffer", "suffix": "", "label": "school buffers"}
+        scenarios.append({**defaults, **scenario})
+    study["scenarios"] = scenarios
+    return study
+
+
+def schools_graph(study, manifest):
+    """
+    Get the drivable graph around the polygon of study, compatible with Superblockify, and the polygon.
+    Both are in the CRS of the polygon, or in the UTM zone if utm is set.
+    """
+    gdf_poly = gpd.read_file(study["polygon"])
+    # Add a buffer to get surrounding streets
+    gdf_poly = gpd.GeoSeries(
+        [gdf_poly.buffer(study["polygon_buffer"]).union_all()], crs=gdf_poly.crs
+    )
+    gdf_poly_crs = gdf_poly.crs
+    gdf_poly = gdf_poly.to_crs(epsg=4326)
+    # Extract non-simplified so we can simplify after removing nodes
+    with manifest.step("graph_from_polygon") as step:
+        G = ox.graph_from_polygon(
+            gdf_poly.geometry[0], simplify=False, network_type="drive"
+        )
+        toremove = []
+        # Remove forbidden places to drive
+        for e in G.edges:
+            if "access" in G.edges[e]:
+                if G.edges[e]["access"] == "no":
+                    toremove.append(e)
+            if "area" in G.edges[e]:
+                G.edges[e].pop("area")
+        G.remove_edges_from(toremove)
+        # Keep only the LCC and simplify
+        G = G.subgraph(max(nx.weakly_connected_components(G), key=len))
+        # Remove dead-ends
+        G = remove_dead_ends(G)
+        G = ox.simplify_graph(G)
+        # Add geometry attribute to non-simplified edges
+        for u, v, k in G.edges:
+            if "geometry" not in G.edges[u, v, k]:
+                G.edges[u, v, k]["geometry"] = shapely.LineString(
+                    [
+                        [G.nodes[u]["x"], G.nodes[u]["y"]],
+                        [G.nodes[v]["x"], G.nodes[v]["y"]],
+                    ]
+                )
+        # Remove again dead-ends that were connected by multiple roads
+        G = remove_dead_ends(G)
+        step["graph"] = G
+    gdf_poly = gdf_poly.to_crs(
+        gdf_poly.estimate_utm_crs() if study["utm"] else gdf_poly_crs
+    )
+    G = make_graph_compatible(
+        G, poly=gdf_poly, proj_crs=gdf_poly.crs, step=manifest.step
+    )
+    return G, gdf_poly
+
+
+def load_schools(study, crs, poly):
+    "Get the schools of study in crs, filtered as declared in the study."
+    schools = study["schools"]
+    gdf_school = gpd.read_file(schools["file"]).to_crs(crs)
+    if schools["filter"] is not None:
+        gdf_school = gdf_school[
+            gdf_school[schools["filter"]["column"]].isin(schools["filter"]["values"])
+        ]
+    if schools["within_polygon"]:
+        gdf_school = gdf_school[gdf_school.geometry.within(poly)]
+    return gdf_school
+
+
+def tag_scenarios(G, study, gdf_poly, gdf_school):
+    "Tag in place the edges of G for each scenario of study and save the metadata of the graph."
+    folder_results = study["output"]
+    area = gdf_poly.geometry[0].area / 1000000
+    roadsum = sum([G.edges[e]["length"] for e in G.edges]) / 1000
+    popsum = sum([G.edges[e]["population"] for e in G.edges])
+    all_arr = [
+        study["city"],
+        area,
+        len(G.edges),
+        roadsum,
+        roadsum / area,
+        popsum,
+        popsum / area,
+    ]
+    nr_roadsum = sum(
+        [
+            G.edges[e]["length"]
+            for e in G.edges
+            if G.edges[e]["highway"] != "residential"
+        ]
+    )
+    # Distances to the nearest school, any buffer size is a threshold on them
+    if study["metadata_distances"] is not None or any(
+        "distance" in scenario for scenario in study["scenarios"]
+    ):
+        add_edge_distances(G, gdf_school.geometry, "school_distance")
+    for scenario in study["scenarios"]:
+        if "distance" in scenario:
+            removed_length = tag_edges_within(
+                G, "school_distance", scenario["distance"], suffix=scenario["suffix"]
+            )
+        else:
+            gdf_buffered = gpd.read_file(scenario["zones"]).to_crs(gdf_poly.crs)
+            removed_length = tag_edges_in_buffer(
+                G, gdf_buffered, suffix=scenario["suffix"]
+            )
+        all_arr.append(removed_length / nr_roadsum)
+    if study["metadata_distances"] is not None:
+        step = study["metadata_distances"]["step"]
+        distances = np.arange(0, study["metadata_distances"]["max"] + step, step)
+        df = pd.DataFrame(
+            {
+                "Buffer size": distances,
+                "Removed non-residential edges": removed_length_within(
+                    G, "school_distance", distances
+                )
+                / nr_roadsum,
+            }
+        )
+        df.to_json(folder_results + "metadata_buffer_sizes.json")
+    ox.save_graphml(G, folder_results + study["city"] + ".graphml")
+    df = pd.DataFrame(
+        [all_arr],
+        columns=[
+            "Name",
+            "Area",
+            "Number of edges",
+            "Total road length",
+            "Road density",
+            "Total estimated population",
+            "Population density",
+            *[
+                f"Removed non-residential edges with {scenario['label']}"
+                for scenario in study["scenarios"]
+            ],
+        ],
+    )
+    df.to_json(folder_results + "metadata.json")
+
+
+def partition_and_save(city_name, part_name, folder_results, manifest, attribute=None):
+    "Run the residential partitioner, or on the edge attribute if given, and save its results."
+    with manifest.step("part.run_" + part_name) as step:
+        kwargs = dict(
+            name=f"{city_name}_{part_name}",
+            city_name=city_name,
+            search_str=city_name,
+            unit="time",
+        )
+        if attribute is None:
+            part = ResidentialPartitioner(**kwargs)
+        else:
+            part = EdgeAttributePartitioner(**kwargs)
+            for e in part.graph.edges:
+                part.graph.edges[e][attribute] = int(part.graph.edges[e][attribute])
+        decode_cells(part.graph)
+        part.run(
+            **({} if attribute is None else {"attribute_name": attribute}),
+            calculate_metrics=True,
+            make_plots=False,
+            replace_max_speeds=False,
+        )
+        part.save()
+        step["graph"] = part.graph
+    with manifest.step("relative_travel_" + part_name, part.graph):
+        G = part.graph.copy()
+        all_part = pd.DataFrame(part.partitions)
+        filt_part = all_part[is_ltn(all_part["area"], all_part["n"])].reset_index(
+            drop=True
+        )
+        # Label edges once, both graphs saved below are derived from the labels
+        overlay = ltn_overlay(part)
+        labels_all = ltn_labels(overlay)
+        labels_filt = ltn_labels(overlay, filt_part["name"])
+        partitions_travel_filt = restricted_partitions(
+            G, part.get_partition_nodes(), labels_filt, filt_part["name"]
+        )
+        dg = path_distance_matrix(G, "length", folder_results + "cache/distances/")
+        travel = relative_travel(G, partitions_travel_filt, dg)
+    with manifest.step("save_" + part_name, G):
+        folder_part = sb.config.Config.RESULTS_DIR + f"/{city_name}_{part_name}/"
+        filt_part = filt_part.drop("subgraph", axis=1)
+        all_part = all_part.drop("subgraph", axis=1)
+        all_part.to_json(folder_part + "all_partitions.json")
+        filt_part.to_json(folder_part + "filt_partitions.json")
+        set_ltn_labels(G, labels_all)
+        ox.save_graphml(G, folder_part + f"{city_name}_all.graphml")
+        set_ltn_labels(G, labels_filt)
+        G.graph.update(travel)
+        ox.save_graphml(G, folder_part + f"{city_name}_filt.graphml")
+        save_graph_parquet(G, folder_part + f"{city_name}_filt")
+        file_gpkg = sb.config.Config.GRAPH_DIR + f"/{city_name}_{part_name}.gpkg"
+        sb.save_to_gpkg(part, save_path=file_gpkg, ltn_boundary=True)
+        df_filt = read_gpkg(file_gpkg, "ltns", where=is_ltn_sql())
+        write_gpkg(df_filt, folder_results + f"{city_name}_{part_name}_filt_ltns.gpkg")
+
+
+def save_schools_results(city_name, part_names, folder_results, gdf_school):
+    "Save in folder_results the table of results of the partitioners part_names of city_name."
+    col_names = [
+        "Partitioner",
+        "Amount of superblocks",
+        "Share of streets within superblocks",
+        "Share of the population within superblocks",
+        "Area of pacified streets",
+        "Schools within a superblock",
+        "Superblocks without a school",
+        "Average travel distance increase",
+        "Maximal detour",
+    ]
+    all_arr = []
+    for part_name in part_names:
+        filepath = (
+            sb.config.Config.RESULTS_DIR + f"/{city_name}_{part_name}/{city_name}_filt"
+        )
+        # Native dtypes from the Parquet edge table, missing in_ltn is False
+        edges = load_edge_columns(
+            filepath, ["length", "population", "cell_area", "in_ltn"]
+        )
+        in_ltn = edges["in_ltn"].astype(bool)
+        graph = load_graph_attributes(filepath)
+        roadsum, popsum, areasum = [
+            round(100 * float(edges[name][in_ltn].sum() / edges[name].sum()), 1)
+            for name in ["length", "population", "cell_area"]
+        ]
+        part = read_gpkg(
+            folder_results + f"{city_name}_{part_name}.gpkg",
+            "ltns",
+            columns=["classification", "n", "area"],
+            where=is_ltn_sql("area"),
+        )
+        # Schools in each LTN, with a single spatial join
+        part["schools"], school_in_ltn = count_within(
+            gdf_school.geometry, part.geometry
+        )
+        write_gpkg(part, folder_results + f"{city_name}_{part_name}_schools.gpkg")
+        all_arr.append(
+            [
+                part_name,
+                len(part["classification"]),
+                roadsum,
+                popsum,
+                areasum,
+                round(100 * float(school_in_ltn.mean()), 1),
+                round(100 * float((part["schools"] > 0).mean()), 1),
+                round(100 * (float(graph["avg_rel_travel"]) - 1), 5),
+                round(float(graph["max_detour"]) / 1000, 1),
+            ]
+        )
+    df = pd.DataFrame(all_arr, columns=col_names)
+    df.to_json(folder_results + f"results_{city_name}_filtered.json")
+
+
+def run_schools_study(study, profile_step=None):
+    "Run all steps of the schools study loaded by load_schools_study."
+    city_name = study["city"]
+    folder_results = study["output"]
+    os.makedirs(folder_results, exist_ok=True)
+    manifest = StepManifest(
+        folder_results + "manifest.jsonl", "schools", city_name, profile_step
+    )
+    sb.config.Config.GHSL_DIR = study["ghsl_dir"]
+    G, gdf_poly = schools_graph(study, manifest)
+    with manifest.step("school_buffers", G):
+        gdf_school = load_schools(study, gdf_poly.crs, gdf_poly.geometry[0])
+        tag_scenarios(G, study, gdf_poly, gdf_school)
+    sb.config.Config.GRAPH_DIR = folder_results
+    sb.config.Config.RESULTS_DIR = folder_results + "sb_results"
+    partition_and_save(city_name, "residential", folder_results, manifest)
+    # Run partitioner taking into account buffer around schools
+    for scenario in study["scenarios"]:
+        partition_and_save(
+            city_name,
+            scenario["name"],
+            folder_results,
+            manifest,
+            attribute="sparse" + scenario["suffix"],
+        )
+    with manifest.step("results"):
+        save_schools_results(
+            city_name,
+            ["residential"] + [scenario["name"] for scenario in study["scenarios"]],
+            folder_results,
+            gdf_school,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("study", help="Path of the YAML file of the schools study.")
+    parser.add_argument(
+        "--profile-step",
+        default=None,
+        help="Name of a step to profile with cProfile, see profiling.py.",
+    )
+    args = parser.parse_args()
+    run_schools_study(load_schools_study(args.study), args.profile_step)
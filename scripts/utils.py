@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Functions shared by the scripts.
+"""
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import shapely
+
+
+# Output folder of the city partners and folder of the GHSL tiles
+FOLDER_CITY_PARTNERS = "./data/processed/city_partners_public/"
+GHSL_DIR = "./data/raw"
+# Partitions are kept as LTNs if their area in m² and their number of nodes are within these bounds
+LTN_MIN_AREA = 25600
+LTN_MAX_AREA = 921600
+LTN_MIN_N = 5
+LTN_FILTER = (LTN_MIN_AREA, LTN_MAX_AREA, LTN_MIN_N)
+
+
+def is_ltn(area, n, min_area=LTN_MIN_AREA, max_area=LTN_MAX_AREA, min_n=LTN_MIN_N):
+    "Get whether partitions of area in m² and n nodes are kept as LTNs, for numbers or arrays."
+    return (area > min_area) & (area < max_area) & (n > min_n)
+
+
+def is_ltn_sql(
+    area="ST_Area({geometry})",
+    n="n",
+    min_area=LTN_MIN_AREA,
+    max_area=LTN_MAX_AREA,
+    min_n=LTN_MIN_N,
+):
+    "Get the SQL condition of is_ltn on the columns or expressions area and n."
+    return f"{area} > {min_area} AND {area} < {max_area} AND {n} > {min_n}"
+
+
+def remove_dead_ends(G):
+    """
+    Remove iteratively the nodes with less than 2 distinct neighbors, in linear time.
+    G is modified in place, or copied once if it is frozen.
+    """
+    if nx.is_frozen(G):
+        G = G.copy()
+    neighbors = {n: set(G.successors(n)) | set(G.predecessors(n)) for n in G}
+    toremove = set()
+    worklist = [n for n in G if len(neighbors[n]) < 2]
+    while worklist:
+        n = worklist.pop()
+        if n in toremove:
+            continue
+        toremove.add(n)
+        for m in neighbors[n]:
+            if m != n and m not in toremove:
+                neighbors[m].discard(n)
+                if len(neighbors[m]) < 2:
+                    worklist.append(m)
+    G.remove_nodes_from(toremove)
+    return G
+
+
+def decode_cells(G):
+    "Parse in place the WKT or WKB cells of the edges of G and add their cell_area."
+    edges = list(G.edges(keys=True))
+    cells = np.array([G.edges[e]["cell"] for e in edges], dtype=object)
+    is_wkt = np.array([isinstance(c, str) for c in cells], dtype=bool)
+    is_wkb = np.array([isinstance(c, bytes) for c in cells], dtype=bool)
+    cells[is_wkt] = shapely.from_wkt(cells[is_wkt])
+    cells[is_wkb] = shapely.from_wkb(cells[is_wkb])
+    nx.set_edge_attributes(G, dict(zip(edges, cells)), "cell")
+    nx.set_edge_attributes(
+        G, dict(zip(edges, shapely.area(cells).tolist())), "cell_area"
+    )
+
+
+def _tag_edges(G, edges, in_buffer, suffix):
+    "Tag edges of G in place from the boolean array in_buffer, see tag_edges_in_buffer."
+    removed_length = 0
+    for e, inside in zip(edges, in_buffer):
+        residential = G.edges[e]["highway"] in ["residential", "living_street"]
+        G.edges[e][f"in_buffer{suffix}"] = bool(inside)
+        if inside:
+            G.edges[e][f"sparse{suffix}"] = 0
+            if not residential:
+                removed_length += G.edges[e]["length"]
+        else:
+            G.edges[e][f"sparse{suffix}"] = 0 if residential else 1
+    return removed_length
+
+
+def tag_edges_in_buffer(G, gdf_buffered, suffix=""):
+    """
+    Tag in place the edges of G as inside or outside the buffers of gdf_buffered.
+    Edges inside get sparse{suffix} = 0, edges outside get 0 if residential and 1 otherwise.
+    Return the total length of the non-residential edges inside a buffer.
+    """
+    edges = list(G.edges(keys=True))
+    tree = shapely.STRtree(np.asarray(gdf_buffered.geometry))
+    idx_edge, _ = tree.query(
+        [G.edges[e]["geometry"] for e in edges], predicate="intersects"
+    )
+    in_buffer = np.zeros(len(edges), dtype=bool)
+    in_buffer[idx_edge] = True
+    return _tag_edges(G, edges, in_buffer, suffix)
+
+
+def count_within(geometries, polygons):
+    "Get the number of geometries within each polygon and whether each geometry is within one."
+    tree = shapely.STRtree(np.asarray(polygons))
+    idx_geom, idx_poly = tree.query(np.asarray(geometries), predicate="within")
+    inside = np.zeros(len(geometries), dtype=bool)
+    inside[idx_geom] = True
+    return np.bincount(idx_poly, minlength=len(polygons)), inside
+
+
+def add_edge_distances(G, geometries, name):
+    "Add to the edges of G the attribute name, their distance to the nearest of geometries."
+    edges = list(G.edges(keys=True))
+    tree = shapely.STRtree(np.asarray(geometries))
+    (idx_edge, _), dist = tree.query_nearest(
+        [G.edges[e]["geometry"] for e in edges], return_distance=True, all_matches=False
+    )
+    # Edges are infinitely far from an empty set of geometries
+    distances = np.full(len(edges), np.inf)
+    distances[idx_edge] = dist
+    nx.set_edge_attributes(G, dict(zip(edges, distances.tolist())), name)
+
+
+def tag_edges_within(G, name, max_distance, suffix=""):
+    "Tag edges of G as tag_edges_in_buffer, inside being at most max_distance in attribute name."
+    edges = list(G.edges(keys=True))
+    in_buffer = np.array([G.edges[e][name] <= max_distance for e in edges], dtype=bool)
+    return _tag_edges(G, edges, in_buffer, suffix)
+
+
+def removed_length_within(G, name, max_distances):
+    "Get the length that tag_edges_within would return for each of max_distances."
+    dist, length = (
+        np.array(
+            [
+                [d[name], d["length"]]
+                for _, _, d in G.edges(data=True)
+                if d["highway"] not in ["residential", "living_street"]
+            ]
+        )
+        .reshape(-1, 2)
+        .T
+    )
+    order = np.argsort(dist)
+    cum_length = np.concatenate([[0], np.cumsum(length[order])])
+    return cum_length[np.searchsorted(dist[order], max_distances, side="right")]
+
+
+def ltn_overlay(part):
+    "Get the name of the partition of each edge of part, None for the sparsified edges."
+    edges = []
+    names = []
+    for p in part.partitions:
+        n = len(edges)
+        edges.extend(p["subgraph"].edges(keys=True))
+        names.extend([p["name"]] * (len(edges) - n))
+    n = len(edges)
+    edges.extend(part.sparsified.edges(keys=True))
+    names.extend([None] * (len(edges) - n))
+    overlay = pd.DataFrame(
+        {"ltn_name": names},
+        index=pd.MultiIndex.from_tuples(edges, names=["u", "v", "key"]),
+        dtype=object,
+    )
+    # Sparsified edges come last so they take precedence, as when they were copied last
+    return overlay[~overlay.index.duplicated(keep="last")]
+
+
+def ltn_labels(overlay, names=None):
+    "Get the columns ltn_name and in_ltn from overlay, with only names as LTNs if given."
+    ltn_name = overlay["ltn_name"]
+    if names is not None:
+        ltn_name = ltn_name.where(ltn_name.isin(names), None)
+    return pd.DataFrame({"ltn_name": ltn_name, "in_ltn": ltn_name.notna()})
+
+
+def set_ltn_labels(G, labels):
+    "Set in place the edge attributes ltn_name and in_ltn of G from labels."
+    edges = labels.index.tolist()
+    nx.set_edge_attributes(G, dict(zip(edges, labels["ltn_name"].tolist())), "ltn_name")
+    nx.set_edge_attributes(G, dict(zip(edges, labels["in_ltn"].tolist())), "in_ltn")
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+Make the modules of the scripts folder importable by the tests.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts"))
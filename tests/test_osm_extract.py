@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Build the graphs of the small OSM extract of "./data/raw/osm_extract_fixture/", see its 00_source.txt.
+"""
+
+import os
+import pytest
+import shapely
+from osm_extract import graphs_from_extract
+from gpkg_io import read_gpkg
+from graph_io import load_graph_parquet
+from city_partners_00_create_graphs import create_graphs
+
+
+FOLDER_FIXTURE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data",
+    "raw",
+    "osm_extract_fixture",
+)
+EXTRACT = os.path.join(FOLDER_FIXTURE, "extract.osm")
+FILE_POLYS = {
+    city_name: os.path.join(FOLDER_FIXTURE, "polygons", city_name + ".gpkg")
+    for city_name in ["North", "South"]
+}
+# Ways of extract.osm excluded by the drive filter of OSMnx
+EXCLUDED_WAYS = {120, 121, 122, 123}
+ACCESS_NO_WAY = 124
+DISCONNECTED_WAY = 125
+
+
+def way_ids(G):
+    "Get the OSM ids of the ways of the edges of G, simplified edges having a list of them."
+    ids = set()
+    for _, _, osmid in G.edges(data="osmid"):
+        ids.update(osmid if isinstance(osmid, list) else [osmid])
+    return ids
+
+
+@pytest.fixture(scope="module")
+def graphs():
+    return graphs_from_extract(
+        EXTRACT,
+        {
+            city_name: read_gpkg(file_poly).geometry[0]
+            for city_name, file_poly in FILE_POLYS.items()
+        },
+    )
+
+
+def test_graphs_from_extract_filters_ways(graphs):
+    assert set(graphs) == set(FILE_POLYS)
+    ids = set.union(*[way_ids(G) for G in graphs.values()])
+    assert not ids & EXCLUDED_WAYS
+    assert DISCONNECTED_WAY not in ids
+    # Kept by the filter, as by Overpass, and removed by create_graphs
+    assert ACCESS_NO_WAY in ids
+
+
+def test_graphs_from_extract_matches_overpass_attributes(graphs):
+    for G in graphs.values():
+        assert len(G) > 0
+        for _, _, d in G.edges(data=True):
+            assert "motor_vehicle" not in d
+            assert "motorcar" not in d
+    # Nodes on the boundary between the polygons keep the streets of the other half
+    polygons = [read_gpkg(file_poly).geometry[0] for file_poly in FILE_POLYS.values()]
+    G_all = graphs_from_extract(EXTRACT, {"all": shapely.union_all(polygons)})["all"]
+    for G in graphs.values():
+        for node, street_count in G.nodes(data="street_count"):
+            assert street_count == G_all.nodes[node]["street_count"]
+
+
+def test_create_graphs_from_extract(tmp_path, monkeypatch):
+    # Outputs go to the data folders relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    assert create_graphs(FILE_POLYS, extract=EXTRACT) == list(FILE_POLYS)
+    folder_graph = tmp_path / "data" / "processed" / "city_partners_public"
+    for city_name in FILE_POLYS:
+        G = load_graph_parquet(str(folder_graph / "graphs_OSM" / city_name))
+        ids = way_ids(G)
+        assert ACCESS_NO_WAY not in ids
+        assert not ids & EXCLUDED_WAYS
+        assert DISCONNECTED_WAY not in ids
+        assert (folder_graph / "geoms" / (city_name + ".gpkg")).exists()
+    # Cached on the second run
+    assert create_graphs(FILE_POLYS, extract=EXTRACT) == []
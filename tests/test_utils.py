@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Tag the edges of a small graph inside buffers around schools.
+"""
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import shapely
+from utils import add_edge_distances, tag_edges_within
+
+
+def street_graph():
+    "Get a straight street of three edges, residential in the middle."
+    G = nx.MultiDiGraph()
+    for i, highway in enumerate(["primary", "residential", "primary"]):
+        G.add_edge(
+            i,
+            i + 1,
+            geometry=shapely.LineString([(100 * i, 0), (100 * (i + 1), 0)]),
+            length=100.0,
+            highway=highway,
+        )
+    return G
+
+
+def test_add_edge_distances():
+    "Distances are to the nearest school."
+    G = street_graph()
+    add_edge_distances(G, gpd.GeoSeries([shapely.Point(50, 10)]), "school_distance")
+    assert np.allclose(
+        [d for _, _, d in G.edges(data="school_distance")],
+        [10, np.hypot(50, 10), np.hypot(150, 10)],
+    )
+    assert tag_edges_within(G, "school_distance", 50, suffix="_50") == 100
+    assert [d for _, _, d in G.edges(data="in_buffer_50")] == [True, False, False]
+
+
+def test_add_edge_distances_without_schools():
+    "Without schools, all edges are infinitely far and none is inside a buffer."
+    G = street_graph()
+    add_edge_distances(G, gpd.GeoSeries([]), "school_distance")
+    assert all(np.isinf(d) for _, _, d in G.edges(data="school_distance"))
+    assert tag_edges_within(G, "school_distance", 200) == 0
+    assert not any(d for _, _, d in G.edges(data="in_buffer"))
+    assert [d for _, _, d in G.edges(data="sparse")] == [1, 0, 1]